@@ -0,0 +1,69 @@
+import os
+
+from up_print import DocumentCoalescer, _archive_watch_file, _classify_watch_path, _list_watch_dir
+
+
+def test_coalescer_releases_group_at_max_documents():
+    coalescer = DocumentCoalescer(max_bytes=1000, max_documents=2, window_seconds=60)
+    assert coalescer.add("p1", "a.pdf", 10, now=0) == []
+    ready = coalescer.add("p1", "b.pdf", 10, now=1)
+    assert [group.sources for group in ready] == [["a.pdf", "b.pdf"]]
+    assert coalescer.flush() == []
+
+
+def test_coalescer_starts_new_group_when_bytes_would_overflow():
+    coalescer = DocumentCoalescer(max_bytes=100, max_documents=10, window_seconds=60)
+    coalescer.add("p1", "a.pdf", 60, now=0)
+    ready = coalescer.add("p1", "b.pdf", 60, now=1)
+    assert [group.sources for group in ready] == [["a.pdf"]]
+    assert [group.sources for group in coalescer.flush()] == [["b.pdf"]]
+
+
+def test_coalescer_releases_groups_after_window():
+    coalescer = DocumentCoalescer(max_bytes=1000, max_documents=10, window_seconds=5)
+    coalescer.add("p1", "a.pdf", 10, now=0)
+    coalescer.add("p2", "b.pdf", 10, now=3)
+    assert [group.sources for group in coalescer.due(now=4)] == []
+    assert [group.sources for group in coalescer.due(now=5)] == [["a.pdf"]]
+    assert [group.sources for group in coalescer.due(now=8)] == [["b.pdf"]]
+
+
+def test_coalescer_keeps_printers_and_keys_apart():
+    coalescer = DocumentCoalescer(max_bytes=1000, max_documents=10, window_seconds=60)
+    coalescer.add("p1", "a.pdf", 10, now=0, key="normal")
+    coalescer.add("p1", "b.pdf", 10, now=0, key="bulk")
+    coalescer.add("p2", "c.pdf", 10, now=0, key="normal")
+    groups = sorted(coalescer.flush(), key=lambda group: group.sources)
+    assert [(group.printer_id, group.key, group.sources) for group in groups] == [
+        ("p1", "normal", ["a.pdf"]),
+        ("p1", "bulk", ["b.pdf"]),
+        ("p2", "normal", ["c.pdf"]),
+    ]
+
+
+def test_watch_dir_listing_skips_hidden_and_outcome_dirs(tmp_path):
+    for relative in ("a.pdf", ".partial.pdf", "high/b.pdf", "done/old.pdf", "failed/bad.pdf", ".tmp/c.pdf", "sub/done/d.pdf"):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"%PDF")
+    listed = [os.path.relpath(p, tmp_path) for p in _list_watch_dir(str(tmp_path))]
+    assert sorted(listed) == sorted(["a.pdf", os.path.join("high", "b.pdf"), os.path.join("sub", "done", "d.pdf")])
+
+
+def test_archive_keeps_relative_path_and_never_overwrites(tmp_path):
+    (tmp_path / "high").mkdir()
+    first = tmp_path / "high" / "a.pdf"
+    first.write_bytes(b"one")
+    moved = _archive_watch_file(str(tmp_path), str(first), "done")
+    assert moved == str(tmp_path / "done" / "high" / "a.pdf")
+    first.write_bytes(b"two")
+    moved_again = _archive_watch_file(str(tmp_path), str(first), "done")
+    assert moved_again == str(tmp_path / "done" / "high" / "a.1.pdf")
+    assert (tmp_path / "done" / "high" / "a.pdf").read_bytes() == b"one"
+    assert not first.exists()
+
+
+def test_classify_watch_path_reads_priority_and_submitter(tmp_path):
+    path = os.path.join(str(tmp_path), "high", "picking", "list.pdf")
+    assert _classify_watch_path(str(tmp_path), path, "normal", "default") == ("high", "picking")
+    assert _classify_watch_path(str(tmp_path), os.path.join(str(tmp_path), "x.pdf"), "normal", "default") == ("normal", "default")
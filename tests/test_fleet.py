@@ -0,0 +1,156 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+import up_print
+from up_print import FleetSnapshot, _parse_graph_datetime
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+def iso(seconds_ago):
+    return datetime.fromtimestamp(NOW - seconds_ago, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.1234567Z")
+
+
+def job(job_id, state, seconds_ago=None):
+    entry = {"id": job_id, "status": {"state": state}}
+    if seconds_ago is not None:
+        entry["createdDateTime"] = iso(seconds_ago)
+    return entry
+
+
+class FakeGraph:
+    """Serves `_list_graph_collection` from in-memory printers and jobs."""
+
+    def __init__(self, printers, jobs):
+        self.printers = printers
+        self.jobs = jobs
+        self.failing = set()
+        self.listed = []
+
+    def list(self, token, url, action):
+        if "/jobs?" not in url:
+            return [{"id": printer_id, "displayName": name} for printer_id, name in self.printers.items()]
+        printer_id = url.split("/printers/")[1].split("/")[0]
+        self.listed.append(printer_id)
+        if printer_id in self.failing:
+            raise RuntimeError(f"List jobs failed for {printer_id}")
+        return self.jobs.get(printer_id, [])
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    fake = FakeGraph(
+        {"p1": "Front desk", "p2": "Warehouse"},
+        {
+            "p1": [job("a", "processing", 30), job("b", "completed", 30), job("c", "pending", 600)],
+            "p2": [job("d", "paused", 7200), job("e", "pending")],
+        },
+    )
+    monkeypatch.setattr(up_print, "_list_graph_collection", fake.list)
+    monkeypatch.setattr(up_print.time, "time", lambda: NOW)
+    return fake
+
+
+# _parse_graph_datetime
+
+
+def test_parse_graph_datetime_handles_seven_fraction_digits():
+    expected = datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=timezone.utc).timestamp()
+    assert _parse_graph_datetime("2024-05-01T12:00:00.1234567Z") == pytest.approx(expected)
+
+
+def test_parse_graph_datetime_handles_offsets_and_whole_seconds():
+    assert _parse_graph_datetime("2024-05-01T14:00:00+02:00") == pytest.approx(NOW)
+    assert _parse_graph_datetime("2024-05-01T12:00:00Z") == pytest.approx(NOW)
+    assert _parse_graph_datetime("2024-05-01T12:00:00") == pytest.approx(NOW)
+
+
+def test_parse_graph_datetime_returns_none_for_missing_or_bad_values():
+    assert _parse_graph_datetime(None) is None
+    assert _parse_graph_datetime("") is None
+    assert _parse_graph_datetime("yesterday") is None
+
+
+# FleetSnapshot aggregates
+
+
+def test_snapshot_aggregates(graph):
+    snapshot = FleetSnapshot("token", max_workers=2)
+    assert snapshot.discover_targets() == 2
+    assert snapshot.refresh() == 2
+    summary = snapshot.summary()
+    assert (summary["targets"], summary["listed"], summary["failed"], summary["jobs"]) == (2, 2, 0, 5)
+    assert summary["states"] == {"processing": 1, "completed": 1, "pending": 2, "paused": 1}
+    assert snapshot.queue_depth() == {"p1": 2, "p2": 2}
+    histogram = snapshot.age_distribution()
+    assert (histogram["<1m"], histogram["5-15m"], histogram[">4h"], histogram["unknown"]) == (1, 1, 0, 1)
+    assert histogram["1-4h"] == 1
+    assert summary["queue_depth"]["p1"]["name"] == "Front desk"
+
+
+def test_refresh_by_age_only_relists_stale_targets(graph):
+    snapshot = FleetSnapshot("token")
+    snapshot.discover_targets()
+    snapshot.refresh()
+    graph.listed.clear()
+    snapshot.refreshed_at["p1"] = NOW - 30
+    snapshot.refreshed_at["p2"] = NOW - 600
+    assert snapshot.refresh(max_age=300) == 1
+    assert graph.listed == ["p2"]
+
+
+def test_failed_listing_is_reported_and_cleared_on_success(graph):
+    graph.failing.add("p2")
+    snapshot = FleetSnapshot("token")
+    snapshot.discover_targets()
+    assert snapshot.refresh() == 1
+    assert snapshot.summary()["failed"] == 1
+    graph.failing.clear()
+    snapshot.refresh()
+    assert snapshot.summary()["failed"] == 0
+
+
+def test_rediscovery_drops_removed_targets_including_failed_ones(graph):
+    graph.failing.add("p2")
+    snapshot = FleetSnapshot("token")
+    snapshot.discover_targets()
+    snapshot.refresh()
+    graph.printers.pop("p2")
+    graph.printers.pop("p1")
+    graph.printers["p3"] = "New"
+    assert snapshot.discover_targets() == 1
+    summary = snapshot.summary()
+    assert (summary["targets"], summary["listed"], summary["failed"], summary["jobs"]) == (1, 0, 0, 0)
+    assert snapshot.refresh(max_age=300) == 1
+
+
+def graph_response(status, body=b"{}", retry_after=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    if retry_after is not None:
+        resp.headers["Retry-After"] = retry_after
+    return resp
+
+
+def test_listing_retries_throttled_pages_after_retry_after(monkeypatch, clock):
+    responses = [
+        graph_response(503, retry_after="2"),
+        graph_response(200, json.dumps({"value": [{"id": "a"}], "@odata.nextLink": "https://graph/next"}).encode()),
+        graph_response(429, retry_after="3"),
+        graph_response(200, json.dumps({"value": [{"id": "b"}]}).encode()),
+    ]
+    monkeypatch.setattr(up_print.requests, "request", lambda method, url, **kwargs: responses.pop(0))
+    items = up_print._list_graph_collection("token", "https://graph/first", "List printers")
+    assert [item["id"] for item in items] == ["a", "b"]
+    assert clock.slept == [2.0, 3.0]
+
+
+def test_listing_gives_up_after_bounded_retries(monkeypatch, clock):
+    monkeypatch.setattr(up_print.requests, "request", lambda method, url, **kwargs: graph_response(503, retry_after="1"))
+    with pytest.raises(RuntimeError):
+        up_print._list_graph_collection("token", "https://graph/first", "List printers")
+    assert len(clock.slept) == up_print.THROTTLE_RETRIES
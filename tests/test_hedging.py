@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import up_print
+from up_print import LatencyTracker, _send_request
+
+
+class FakeTransport:
+    """Replaces requests.request; each call sleeps for the next latency in `latencies`.
+
+    A latency of None stalls until the call's timeout and raises ReadTimeout,
+    like a connection that never answers.
+    """
+
+    def __init__(self, latencies):
+        self.latencies = list(latencies)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, timeout=None, **kwargs):
+        with self._lock:
+            index = len(self.calls)
+            latency = self.latencies[min(index, len(self.latencies) - 1)]
+            self.calls.append({"started": time.monotonic(), "timeout": timeout})
+        if latency is None:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"stalled for {timeout:.2f}s")
+        time.sleep(latency)
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = str(index).encode()
+        return resp
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Enable hedging with a fixed 0.1s hedge delay and fresh counters."""
+    monkeypatch.setitem(up_print._HEDGING, "enabled", True)
+    monkeypatch.setattr(up_print, "REQUEST_LATENCY", LatencyTracker(default_delay=0.1))
+    monkeypatch.setattr(up_print, "HEDGE_STATS", {"sent": 0, "won": 0})
+
+    def install(latencies):
+        transport = FakeTransport(latencies)
+        monkeypatch.setattr(up_print.requests, "request", transport)
+        return transport
+
+    return install
+
+
+def get(deadline=None, timeout=30):
+    return _send_request("GET", "https://graph/jobs/1", "get job", timeout, deadline=deadline, idempotent=True)
+
+
+# LatencyTracker
+
+
+def test_latency_tracker_uses_default_until_enough_samples():
+    tracker = LatencyTracker(min_samples=5, default_delay=1.0, min_delay=0.05)
+    for _ in range(4):
+        tracker.record("get job", 0.2)
+    assert tracker.hedge_delay("get job") == 1.0
+    tracker.record("get job", 0.2)
+    assert tracker.hedge_delay("get job") == pytest.approx(0.2)
+
+
+def test_latency_tracker_p95_and_floor():
+    tracker = LatencyTracker(min_samples=1, min_delay=0.05)
+    for ms in range(1, 101):
+        tracker.record("get job", ms / 1000.0)
+    assert tracker.percentile("get job", 95) == pytest.approx(0.095)
+    fast = LatencyTracker(min_samples=1, min_delay=0.05)
+    fast.record("get job", 0.001)
+    assert fast.hedge_delay("get job") == 0.05
+
+
+# Hedge counting
+
+
+def test_fast_response_sends_no_hedge(hedging):
+    transport = hedging([0.01])
+    assert get().content == b"0"
+    assert len(transport.calls) == 1
+    assert up_print.HEDGE_STATS == {"sent": 0, "won": 0}
+
+
+def test_hedge_that_answers_first_is_counted_as_won(hedging):
+    hedging([1.0, 0.01])
+    assert get().content == b"1"
+    assert up_print.HEDGE_STATS == {"sent": 1, "won": 1}
+
+
+def test_original_that_answers_first_is_not_counted_as_won(hedging):
+    hedging([0.2, 1.0])
+    assert get().content == b"0"
+    assert up_print.HEDGE_STATS == {"sent": 1, "won": 0}
+
+
+def test_hedge_masks_a_failed_original(hedging):
+    hedging([None, 0.01])
+    assert get(timeout=0.5).content == b"1"
+    assert up_print.HEDGE_STATS == {"sent": 1, "won": 1}
+
+
+def test_writes_are_never_hedged(hedging):
+    transport = hedging([0.3])
+    _send_request("POST", "https://graph/jobs", "create job", 30)
+    assert len(transport.calls) == 1
+    assert up_print.HEDGE_STATS["sent"] == 0
+
+
+# Deadlines
+
+
+def test_timeout_is_clamped_to_the_deadline(monkeypatch):
+    timeouts = []
+
+    def transport(method, url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        resp = requests.Response()
+        resp.status_code = 200
+        return resp
+
+    monkeypatch.setattr(up_print.requests, "request", transport)
+    _send_request("GET", "https://graph/jobs/1", "get job", 30, deadline=time.monotonic() + 2.0)
+    assert 1.9 < timeouts[0] <= 2.0
+
+
+def test_expired_deadline_fails_before_sending(hedging):
+    transport = hedging([0.01])
+    with pytest.raises(TimeoutError):
+        get(deadline=time.monotonic() - 1)
+    assert transport.calls == []
+
+
+def test_hedged_read_never_runs_past_the_deadline(hedging):
+    transport = hedging([None])
+    deadline = time.monotonic() + 0.4
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        get(deadline=deadline)
+    assert time.monotonic() - started < 0.55
+    assert len(transport.calls) == 2
+    for call in transport.calls:
+        assert call["started"] + call["timeout"] <= deadline + 0.01
+    assert up_print.HEDGE_STATS["sent"] == 1
+
+
+def test_no_hedge_once_the_deadline_has_passed(hedging, monkeypatch):
+    # Hedge delay longer than the remaining budget: the wait is cut at the deadline
+    monkeypatch.setattr(up_print, "REQUEST_LATENCY", LatencyTracker(default_delay=5.0))
+    transport = hedging([None])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        get(deadline=time.monotonic() + 0.2)
+    assert len(transport.calls) == 1
+    assert up_print.HEDGE_STATS["sent"] == 0
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+import requests
+
+import up_print
+from up_print import Cassette, ReplayTransport, _send_request
+
+
+def exchange(method, url, status, body="", elapsed=0.0):
+    return {"method": method, "url": url, "status": status, "headers": {}, "body": body, "elapsed": elapsed}
+
+
+def test_replay_serves_exchanges_in_order_and_reuses_last(clock):
+    cassette = Cassette([
+        exchange("GET", "https://graph/jobs/1", 200, '{"state": "processing"}'),
+        exchange("GET", "https://graph/jobs/1", 200, '{"state": "completed"}'),
+        exchange("POST", "https://graph/jobs/1", 201, "created"),
+    ])
+    transport = ReplayTransport(cassette)
+    assert transport.send("POST", "https://graph/jobs/1").status_code == 201
+    states = [transport.send("GET", "https://graph/jobs/1").json()["state"] for _ in range(3)]
+    assert states == ["processing", "completed", "completed"]
+
+
+def test_replay_matches_redacted_urls(clock):
+    recorded_url = up_print._redact("https://upload/session?tempauthtoken=secret1")
+    transport = ReplayTransport(Cassette([exchange("PUT", recorded_url, 202)]))
+    assert transport.send("PUT", "https://upload/session?tempauthtoken=other").status_code == 202
+
+
+def test_replay_scales_latency_and_times_out(clock):
+    cassette = Cassette([exchange("GET", "https://graph/slow", 200, elapsed=2.0)])
+    transport = ReplayTransport(cassette, latency_scale=0.5)
+    transport.send("GET", "https://graph/slow", timeout=5)
+    assert clock.slept == [1.0]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.send("GET", "https://graph/slow", timeout=0.5)
+
+
+def test_replay_raises_for_unrecorded_request(clock):
+    transport = ReplayTransport(Cassette([]))
+    with pytest.raises(RuntimeError):
+        transport.send("GET", "https://graph/unknown")
+
+
+def response(status, body=b"{}"):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    return resp
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    cassette = Cassette()
+    monkeypatch.setitem(up_print._TRANSPORT, "recorder", cassette)
+    monkeypatch.setitem(up_print._TRANSPORT, "replay", None)
+    return cassette
+
+
+def replay(monkeypatch, cassette, latency_scale=1.0):
+    transport = ReplayTransport(Cassette(json.loads(json.dumps(cassette.exchanges))), latency_scale=latency_scale)
+    monkeypatch.setitem(up_print._TRANSPORT, "recorder", None)
+    monkeypatch.setitem(up_print._TRANSPORT, "replay", transport)
+    return transport
+
+
+def test_recording_redacts_credentials(recorder, monkeypatch):
+    monkeypatch.setattr(up_print.requests, "request", lambda method, url, **kwargs: response(202, b"https://upload?tempauthtoken=abc"))
+    _send_request("PUT", "https://upload/session?tempauthtoken=secret", "upload chunk", 30, headers={"Authorization": "Bearer secret"}, data=b"12345")
+    exchange = recorder.exchanges[0]
+    assert "secret" not in json.dumps(exchange) and "abc" not in json.dumps(exchange)
+    assert exchange["request_headers"]["Authorization"] == "Bearer REDACTED"
+    assert exchange["request_body"] == {"bytes": 5}
+
+
+def test_failed_attempt_is_recorded_and_replayed_in_place(recorder, monkeypatch, clock):
+    outcomes = [requests.exceptions.ConnectionError("reset by peer"), response(200, b'{"n": 2}')]
+
+    def transport(method, url, **kwargs):
+        outcome = outcomes.pop(0)
+        clock.now += 1.5
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(up_print.requests, "request", transport)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _send_request("GET", "https://graph/jobs/1", "get job", 30)
+    assert _send_request("GET", "https://graph/jobs/1", "get job", 30).json() == {"n": 2}
+    first = recorder.exchanges[0]
+    assert (first["error"], first["elapsed"]) == ("ConnectionError", 1.5)
+    assert "status" not in first
+
+    replay(monkeypatch, recorder)
+    with pytest.raises(requests.exceptions.ConnectionError, match="reset by peer"):
+        _send_request("GET", "https://graph/jobs/1", "get job", 30)
+    assert clock.slept == [1.5]
+    assert _send_request("GET", "https://graph/jobs/1", "get job", 30).json() == {"n": 2}
+
+
+def test_recorded_timeout_replays_as_timeout(recorder, monkeypatch, clock):
+    def stalled(method, url, timeout=None, **kwargs):
+        clock.now += timeout
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    monkeypatch.setattr(up_print.requests, "request", stalled)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _send_request("GET", "https://graph/jobs/1", "get job", 5)
+    replay(monkeypatch, recorder, latency_scale=0.5)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _send_request("GET", "https://graph/jobs/1", "get job", 5)
+    assert clock.slept == [2.5]
+
+
+def test_unknown_recorded_error_replays_as_request_exception(clock):
+    exchange_entry = {"method": "GET", "url": "https://graph/x", "error": "SomethingElse", "error_message": "boom", "elapsed": 0.0}
+    transport = ReplayTransport(Cassette([exchange_entry]))
+    with pytest.raises(requests.exceptions.RequestException, match="boom"):
+        transport.send("GET", "https://graph/x")
+
+
+def test_cassette_save_and_load_round_trip(tmp_path):
+    cassette = Cassette([exchange("GET", "https://graph/jobs/1", 200, "{}")])
+    path = tmp_path / "run.json"
+    cassette.save(str(path))
+    assert Cassette.load(str(path)).exchanges == cassette.exchanges
+    path.write_text(json.dumps({"version": 99, "exchanges": []}))
+    with pytest.raises(RuntimeError, match="version"):
+        Cassette.load(str(path))
@@ -0,0 +1,112 @@
+import pytest
+
+from up_print import JobScheduler
+
+
+def dispatch_all(scheduler):
+    """Dispatch and immediately complete jobs one at a time; returns payloads in order."""
+    order = []
+    while True:
+        job = scheduler.next_ready()
+        if job is None:
+            return order
+        order.append(job.payload)
+        scheduler.done(job)
+
+
+def test_scheduler_serves_higher_priority_first():
+    scheduler = JobScheduler()
+    scheduler.submit("bulk", priority="bulk")
+    scheduler.submit("normal", priority="normal")
+    scheduler.submit("high", priority="high")
+    assert dispatch_all(scheduler) == ["high", "normal", "bulk"]
+
+
+def test_scheduler_round_robins_submitters_within_a_class():
+    scheduler = JobScheduler()
+    for i in range(3):
+        scheduler.submit(f"a{i}", submitter="a")
+    scheduler.submit("b0", submitter="b")
+    scheduler.submit("c0", submitter="c")
+    assert dispatch_all(scheduler) == ["a0", "b0", "c0", "a1", "a2"]
+
+
+def test_scheduler_keeps_fifo_order_per_submitter_and_printer():
+    scheduler = JobScheduler()
+    for i in range(5):
+        scheduler.submit(i, printer_id="p1")
+    assert dispatch_all(scheduler) == [0, 1, 2, 3, 4]
+
+
+def test_scheduler_skips_saturated_printer():
+    scheduler = JobScheduler(max_per_printer=1)
+    scheduler.submit("p1-a", printer_id="p1")
+    scheduler.submit("p1-b", printer_id="p1")
+    scheduler.submit("p2-a", printer_id="p2")
+    first = scheduler.next_ready()
+    second = scheduler.next_ready()
+    assert (first.payload, second.payload) == ("p1-a", "p2-a")
+    assert scheduler.next_ready() is None
+    scheduler.done(first)
+    assert scheduler.next_ready().payload == "p1-b"
+
+
+def test_scheduler_enforces_group_limit():
+    scheduler = JobScheduler(max_per_printer=10, group_limit=lambda group: 1)
+    scheduler.submit("t1-a", printer_id="p1", group="t1")
+    scheduler.submit("t1-b", printer_id="p2", group="t1")
+    scheduler.submit("t2-a", printer_id="p3", group="t2")
+    running = [scheduler.next_ready(), scheduler.next_ready()]
+    assert [job.payload for job in running] == ["t1-a", "t2-a"]
+    assert scheduler.next_ready() is None
+    scheduler.done(running[0])
+    assert scheduler.next_ready().payload == "t1-b"
+    assert scheduler.queued() == 0
+
+
+def test_scheduler_reports_jobs_that_can_never_run():
+    scheduler = JobScheduler(group_limit=lambda group: 0 if group == "blocked" else 4)
+    scheduler.submit("ok", group="open")
+    scheduler.submit("stuck", group="blocked")
+    results = {}
+
+    def on_done(job, future):
+        results[job.payload] = future.exception()
+
+    scheduler.run(lambda payload: payload, 2, on_done)
+    assert results["ok"] is None
+    assert isinstance(results["stuck"], RuntimeError)
+    assert scheduler.queued() == 0
+
+
+def test_scheduler_rejects_unknown_priority():
+    with pytest.raises(ValueError):
+        JobScheduler().submit("x", priority="urgent")
+
+
+def test_scheduler_queue_time_stats(clock):
+    scheduler = JobScheduler()
+    scheduler.submit("a", priority="high")
+    clock.now += 2.0
+    dispatch_all(scheduler)
+    stats = scheduler.queue_time_stats()
+    assert set(stats) == {"high"}
+    assert stats["high"]["count"] == 1
+    assert stats["high"]["max"] == pytest.approx(2.0)
+
+
+def test_scheduler_run_keeps_feeding_until_feed_returns_false():
+    scheduler = JobScheduler()
+    batches = [["a", "b"], ["c"], []]
+    finished = []
+
+    def feed():
+        if not batches:
+            return False
+        for payload in batches.pop(0):
+            scheduler.submit(payload)
+        return True
+
+    scheduler.run(lambda payload: payload.upper(), 2, lambda job, future: finished.append(future.result()), feed=feed, feed_interval=0.01)
+    assert sorted(finished) == ["A", "B", "C"]
+    assert scheduler.queued() == 0
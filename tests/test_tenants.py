@@ -0,0 +1,237 @@
+import argparse
+
+import pytest
+import requests
+
+import up_print
+from up_print import TenantContext, TenantRegistry, TokenBucket, _printer_setup, run_tenant_job
+
+CONFIGS = {
+    key: {"tenant_id": f"{key}-tid", "client_id": f"{key}-cid", "client_secret": "secret"}
+    for key in ("a", "b", "c")
+}
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Count token fetches per tenant instead of calling MSAL."""
+    counts = {}
+
+    def fetch(self):
+        counts[self.key] = counts.get(self.key, 0) + 1
+        return f"token-{self.key}"
+
+    monkeypatch.setattr(TenantContext, "_fetch_token", fetch)
+    return counts
+
+
+def in_tenant(tenant, fn, *args, **kwargs):
+    context_token = up_print._ACTIVE_TENANT.set(tenant)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        up_print._ACTIVE_TENANT.reset(context_token)
+
+
+# TokenBucket
+
+
+def test_token_bucket_allows_burst_then_waits(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert sum(clock.slept) == pytest.approx(0.1)
+
+
+def test_token_bucket_charges_debt_for_oversized_requests(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.acquire(15)
+    # A full bucket is enough to start; the remaining 10 units become debt
+    assert clock.slept == []
+    assert not bucket.try_acquire(1)
+    bucket.acquire(1)
+    assert sum(clock.slept) == pytest.approx(1.1)
+
+
+def test_token_bucket_pause_blocks_until_elapsed(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.pause(3.0)
+    assert not bucket.try_acquire()
+    bucket.acquire()
+    assert sum(clock.slept) == pytest.approx(3.0)
+
+
+def test_token_bucket_raises_instead_of_passing_deadline(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.acquire()
+    with pytest.raises(TimeoutError):
+        bucket.acquire(deadline=clock.now + 0.5)
+    assert clock.slept == []
+    bucket.acquire(deadline=clock.now + 2.0)
+
+
+def test_token_bucket_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    for _ in range(100):
+        bucket.acquire(1000)
+    assert clock.slept == []
+
+
+# TenantRegistry
+
+
+def test_registry_evicts_least_recently_used_idle_tenant():
+    registry = TenantRegistry(CONFIGS, max_active=2)
+    for key in ("a", "b"):
+        registry.release(registry.acquire(key))
+    tenant_a = registry._active["a"]
+    tenant_a.metadata["printer_setup"] = {"p1": {}}
+    registry.release(registry.acquire("c"))
+    assert list(registry._active) == ["b", "c"]
+    assert tenant_a.metadata == {}
+
+
+def test_registry_never_evicts_a_busy_tenant():
+    registry = TenantRegistry(CONFIGS, max_active=1)
+    busy = registry.acquire("a")
+    registry.release(registry.acquire("b"))
+    assert list(registry._active) == ["a"]
+    other = registry.acquire("c")
+    # Every tenant is busy: the limit is exceeded rather than evicting one
+    assert list(registry._active) == ["a", "c"]
+    registry.release(busy)
+    assert list(registry._active) == ["c"]
+    registry.release(other)
+    assert list(registry._active) == ["c"]
+
+
+def test_registry_reuses_contexts_and_rejects_unknown_tenants():
+    registry = TenantRegistry(CONFIGS, max_active=4)
+    first = registry.acquire("a")
+    assert registry.acquire("a") is first
+    assert first.in_flight == 2
+    with pytest.raises(RuntimeError, match="Unknown tenant"):
+        registry.acquire("zzz")
+
+
+def test_registry_job_limit_comes_from_config():
+    configs = dict(CONFIGS, b=dict(CONFIGS["b"], max_concurrent_jobs=1))
+    registry = TenantRegistry(configs)
+    assert (registry.max_concurrent_jobs("a"), registry.max_concurrent_jobs("b")) == (4, 1)
+
+
+# TenantContext
+
+
+def test_tenant_requires_a_secret_for_app_auth(monkeypatch):
+    with pytest.raises(RuntimeError, match="client_secret"):
+        TenantContext("a", {"tenant_id": "t", "client_id": "c"})
+    monkeypatch.setenv("TENANT_A_SECRET", "from-env")
+    tenant = TenantContext("a", {"tenant_id": "t", "client_id": "c", "client_secret_env": "TENANT_A_SECRET"})
+    assert tenant.client_secret == "from-env"
+    assert TenantContext("a", {"tenant_id": "t", "client_id": "c", "auth": "device"}).client_secret is None
+
+
+def test_tenant_tokens_are_cached_per_tenant_and_dropped_on_close(fetched):
+    tenant_a = TenantContext("a", CONFIGS["a"])
+    tenant_b = TenantContext("b", CONFIGS["b"])
+    assert [tenant_a.token(), tenant_a.token(), tenant_b.token()] == ["token-a", "token-a", "token-b"]
+    assert fetched == {"a": 1, "b": 1}
+    tenant_a.close()
+    tenant_a.token()
+    assert fetched["a"] == 2
+
+
+def test_tenant_cache_path_defaults_per_tenant():
+    assert TenantContext("a", CONFIGS["a"], default_cache_path="/tmp/cache.json").cache_path == "/tmp/cache.json.a"
+    assert TenantContext("a", CONFIGS["a"]).cache_path is None
+
+
+def test_429_pauses_only_the_tenants_budget_and_is_retried(monkeypatch, clock):
+    tenant = TenantContext("a", dict(CONFIGS["a"], requests_per_second=100, burst=10))
+    other = TenantContext("b", CONFIGS["b"])
+    responses = [429, 200]
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            resp = requests.Response()
+            resp.status_code = responses.pop(0)
+            resp.headers["Retry-After"] = "2"
+            return resp
+
+    tenant._session = Session()
+    resp = in_tenant(tenant, up_print._send_request, "POST", "https://graph/jobs", "create job", 30)
+    assert resp.status_code == 200
+    assert sum(clock.slept) == pytest.approx(2.0)
+    assert other.throttle.try_acquire()
+
+
+def test_429_is_not_retried_past_the_deadline(clock):
+    tenant = TenantContext("a", CONFIGS["a"])
+    calls = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            calls.append(url)
+            resp = requests.Response()
+            resp.status_code = 429
+            resp.headers["Retry-After"] = "10"
+            return resp
+
+    tenant._session = Session()
+    resp = in_tenant(tenant, up_print._send_request, "POST", "https://graph/jobs", "create job", 30, deadline=clock.now + 5)
+    assert resp.status_code == 429
+    assert len(calls) == 1
+
+
+# Printer setup and job submission
+
+
+@pytest.fixture
+def printer_lookups(monkeypatch):
+    calls = []
+    monkeypatch.setattr(up_print, "preflight_printer", lambda *args, **kwargs: calls.append("preflight"))
+    monkeypatch.setattr(up_print, "_get_printer_defaults", lambda *args, **kwargs: {"copies": 1, "mediaSize": "A4"})
+    monkeypatch.setattr(up_print, "_discover_printer_shares", lambda *args, **kwargs: [{"id": "share-1"}])
+    monkeypatch.setattr(up_print, "_get_printer_capabilities", lambda *args, **kwargs: {"mediaSizes": ["A4", "Letter"]})
+    return calls
+
+
+def test_printer_setup_applies_overrides_and_is_cached_per_tenant(printer_lookups):
+    tenant_a = TenantContext("a", CONFIGS["a"])
+    tenant_b = TenantContext("b", CONFIGS["b"])
+    setup = in_tenant(tenant_a, _printer_setup, "token", "p1", overrides={"mediaSize": "Letter", "copies": 2})
+    assert setup["job_configuration"]["mediaSize"] == "Letter"
+    assert setup["job_configuration"]["copies"] == 2
+    assert setup["share_id"] == "share-1"
+    in_tenant(tenant_a, _printer_setup, "token", "p1")
+    in_tenant(tenant_b, _printer_setup, "token", "p1")
+    assert printer_lookups == ["preflight", "preflight"]
+
+
+def test_printer_setup_rejects_unsupported_overrides(printer_lookups):
+    tenant = TenantContext("a", CONFIGS["a"])
+    with pytest.raises(RuntimeError, match="mediaSize=A3"):
+        in_tenant(tenant, _printer_setup, "token", "p1", overrides={"mediaSize": "A3"})
+
+
+def test_tenant_job_uses_command_line_job_settings(printer_lookups, fetched, monkeypatch, tmp_path):
+    submitted = {}
+
+    def submit_document(token, printer_id, file_path, job_name, content_type, **kwargs):
+        submitted.update(kwargs, token=token, tenant=up_print._ACTIVE_TENANT.get().key)
+        return "job-1"
+
+    monkeypatch.setattr(up_print, "submit_document", submit_document)
+    args = argparse.Namespace(
+        deadline=None, debug=False, job_name="UP Job", content_type=None, max_document_bytes=None,
+        copies=3, duplex_mode=None, media_size="Letter",
+    )
+    registry = TenantRegistry(CONFIGS)
+    job = {"tenant": "b", "printer_id": "p1", "file": str(tmp_path / "a.pdf")}
+    assert run_tenant_job(registry, job, args) == "job-1"
+    assert submitted["job_configuration"] == {"copies": 3, "mediaSize": "Letter"}
+    assert (submitted["token"], submitted["tenant"], submitted["share_id"]) == ("token-b", "b", "share-1")
+    assert registry._active["b"].in_flight == 0
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+import msal
+import pytest
+
+import up_print
+from up_print import _load_token_cache, _save_token_cache, _shared_token_cache, _token_cache_lock
+
+CACHE_STATE = {"AppMetadata": {"appmetadata-login.microsoftonline.com-client": {"client_id": "client", "environment": "login.microsoftonline.com"}}}
+
+
+def changed_cache():
+    token_cache = msal.SerializableTokenCache()
+    token_cache.deserialize(json.dumps(CACHE_STATE))
+    token_cache.has_state_changed = True
+    return token_cache
+
+
+def test_unchanged_cache_is_not_written(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    token_cache = msal.SerializableTokenCache()
+    assert not token_cache.has_state_changed
+    _save_token_cache(token_cache, str(cache_path))
+    assert not cache_path.exists()
+
+
+def test_changed_cache_round_trips_and_leaves_no_temp_files(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    token_cache = changed_cache()
+    _save_token_cache(token_cache, str(cache_path))
+    assert not token_cache.has_state_changed
+    assert os.listdir(tmp_path) == ["cache.json"]
+    reloaded = _load_token_cache(str(cache_path))
+    assert json.loads(reloaded.serialize())["AppMetadata"] == CACHE_STATE["AppMetadata"]
+
+
+def test_failed_replace_keeps_the_previous_file(tmp_path, monkeypatch):
+    cache_path = tmp_path / "cache.json"
+    cache_path.write_text("previous")
+
+    def broken_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(up_print.os, "replace", broken_replace)
+    token_cache = changed_cache()
+    _save_token_cache(token_cache, str(cache_path))
+    assert cache_path.read_text() == "previous"
+    assert os.listdir(tmp_path) == ["cache.json"]
+    # Still dirty, so the next save retries
+    assert token_cache.has_state_changed
+
+
+def test_corrupt_cache_file_loads_as_empty(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    cache_path.write_text("{not json")
+    assert json.loads(_load_token_cache(str(cache_path)).serialize()).get("AccessToken", {}) == {}
+
+
+def test_shared_cache_without_path_is_not_persisted():
+    with _shared_token_cache("") as token_cache:
+        assert token_cache is None
+
+
+def test_shared_cache_saves_changes_on_exit(tmp_path):
+    # The lock creates missing parent directories
+    cache_path = tmp_path / "nested" / "cache.json"
+    with _shared_token_cache(str(cache_path)) as token_cache:
+        token_cache.deserialize(json.dumps(CACHE_STATE))
+        token_cache.has_state_changed = True
+    assert json.loads(cache_path.read_text())["AppMetadata"] == CACHE_STATE["AppMetadata"]
+
+
+@pytest.mark.skipif(up_print.fcntl is None, reason="flock is POSIX only")
+def test_cache_lock_is_exclusive(tmp_path):
+    cache_path = str(tmp_path / "cache.json")
+    holding = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def first():
+        with _token_cache_lock(cache_path):
+            order.append("first acquired")
+            holding.set()
+            release.wait(5)
+            order.append("first released")
+
+    def second():
+        holding.wait(5)
+        with _token_cache_lock(cache_path):
+            order.append("second acquired")
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    holding.wait(5)
+    # Give the second thread time to block on the lock
+    threads[1].join(0.2)
+    assert threads[1].is_alive()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["first acquired", "first released", "second acquired"]
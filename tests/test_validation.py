@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+import up_print
+from up_print import CoalesceGroup, convert_image_to_pdf, prepare_document_for_printer, validate_job_configuration
+
+PDF_ONLY = {"contentTypes": ["application/pdf"]}
+
+
+def write_pdf(path, pages=1):
+    pypdf = pytest.importorskip("pypdf")
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(72, 72)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def write_png(path):
+    image_module = pytest.importorskip("PIL.Image")
+    image_module.new("RGB", (8, 8), "white").save(path, "PNG")
+    return str(path)
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Replace the Graph calls of submit_document; records what each job uploads."""
+    calls = {"jobs": [], "documents": []}
+
+    def create_print_job(token, printer_id, job_name, **kwargs):
+        calls["jobs"].append(job_name)
+        return {"id": f"job-{len(calls['jobs'])}"}, None
+
+    def create_document(token, printer_id, job_id, file_path, content_type, **kwargs):
+        calls["documents"].append({"path": file_path, "content_type": content_type, "name": kwargs.get("document_name")})
+        return "doc", "https://upload"
+
+    monkeypatch.setattr(up_print, "create_print_job", create_print_job)
+    monkeypatch.setattr(up_print, "create_document_and_upload_session", create_document)
+    monkeypatch.setattr(up_print, "upload_file_to_upload_session", lambda *args, **kwargs: None)
+    monkeypatch.setattr(up_print, "start_print_job", lambda *args, **kwargs: None)
+    return calls
+
+
+# validate_job_configuration
+
+
+def test_configuration_within_capabilities_passes():
+    capabilities = {"mediaSizes": ["A4", "Letter"], "duplexModes": ["oneSided"], "copiesPerJob": {"start": 1, "end": 5}}
+    validate_job_configuration({"mediaSize": "A4", "duplexMode": "oneSided", "copies": 5}, capabilities)
+
+
+def test_configuration_reports_every_unsupported_setting():
+    capabilities = {"mediaSizes": ["A4"], "colorModes": ["grayscale"], "copiesPerJob": {"start": 1, "end": 5}}
+    with pytest.raises(RuntimeError) as excinfo:
+        validate_job_configuration({"mediaSize": "A3", "colorMode": "color", "copies": 6}, capabilities)
+    message = str(excinfo.value)
+    assert "mediaSize=A3" in message and "colorMode=color" in message and "copies=6" in message
+
+
+def test_configuration_is_not_blocked_by_missing_capabilities():
+    validate_job_configuration({"mediaSize": "A3", "duplexMode": "twoSidedLongEdge", "copies": 99}, {})
+
+
+# prepare_document_for_printer
+
+
+def test_prepare_rejects_empty_and_oversized_documents(tmp_path):
+    empty = tmp_path / "empty.pdf"
+    empty.write_bytes(b"")
+    with pytest.raises(RuntimeError, match="empty"):
+        prepare_document_for_printer(str(empty), None, PDF_ONLY)
+    document = tmp_path / "a.pdf"
+    document.write_bytes(b"%PDF-1.4" + b"0" * 100)
+    with pytest.raises(RuntimeError, match="byte limit"):
+        prepare_document_for_printer(str(document), None, PDF_ONLY, max_bytes=10)
+
+
+def test_prepare_passes_accepted_documents_through(tmp_path):
+    document = tmp_path / "a.pdf"
+    document.write_bytes(b"%PDF-1.4 test")
+    assert prepare_document_for_printer(str(document), None, PDF_ONLY) == (str(document), "application/pdf", None)
+
+
+def test_prepare_rejects_types_the_printer_cannot_take(tmp_path):
+    document = tmp_path / "a.pdf"
+    document.write_bytes(b"%PDF-1.4 test")
+    with pytest.raises(RuntimeError, match="does not accept application/pdf"):
+        prepare_document_for_printer(str(document), None, {"contentTypes": ["image/pwg-raster"]})
+
+
+def test_prepare_converts_images_for_pdf_only_printers(tmp_path):
+    pypdf = pytest.importorskip("pypdf")
+    image = write_png(tmp_path / "photo.png")
+    path, content_type, temp_path = prepare_document_for_printer(image, None, PDF_ONLY)
+    try:
+        assert content_type == "application/pdf"
+        assert path == temp_path and path != image
+        assert len(pypdf.PdfReader(path).pages) == 1
+    finally:
+        os.remove(temp_path)
+
+
+def test_convert_image_to_pdf_keeps_every_tiff_frame(tmp_path):
+    pypdf = pytest.importorskip("pypdf")
+    image_module = pytest.importorskip("PIL.Image")
+    frames = [image_module.new("RGB", (8, 8), color) for color in ("white", "black", "red")]
+    tiff = tmp_path / "scan.tiff"
+    frames[0].save(tiff, save_all=True, append_images=frames[1:])
+    output = tmp_path / "scan.pdf"
+    convert_image_to_pdf(str(tiff), str(output))
+    assert len(pypdf.PdfReader(str(output)).pages) == 3
+
+
+# submit_document / submit_coalesced_group
+
+
+def test_converted_image_is_uploaded_under_the_users_file_name(tmp_path, fake_pipeline):
+    image = write_png(tmp_path / "photo.png")
+    up_print.submit_document("token", "printer", image, "job", capabilities=PDF_ONLY)
+    document = fake_pipeline["documents"][0]
+    assert document["name"] == "photo.pdf"
+    assert document["content_type"] == "application/pdf"
+    assert not os.path.exists(document["path"])
+
+
+def test_invalid_document_never_creates_a_job(tmp_path, fake_pipeline):
+    empty = tmp_path / "empty.pdf"
+    empty.write_bytes(b"")
+    with pytest.raises(RuntimeError):
+        up_print.submit_document("token", "printer", str(empty), "job", capabilities=PDF_ONLY)
+    assert fake_pipeline["jobs"] == []
+
+
+def test_unreadable_source_is_submitted_alone_and_the_rest_merged(tmp_path, fake_pipeline):
+    group = CoalesceGroup("printer", 0)
+    bad = tmp_path / "bad.pdf"
+    bad.write_bytes(b"not a pdf")
+    group.sources = [write_pdf(tmp_path / "a.pdf"), str(bad), write_pdf(tmp_path / "b.pdf", pages=2)]
+    records = up_print.submit_coalesced_group("token", group, "job", capabilities=PDF_ONLY)
+    by_source = {os.path.basename(record["source"]): record for record in records}
+    assert by_source["bad.pdf"]["job_id"] == "job-1"
+    assert by_source["a.pdf"]["job_id"] == by_source["b.pdf"]["job_id"] == "job-2"
+    assert (by_source["b.pdf"]["first_page"], by_source["b.pdf"]["last_page"]) == (2, 3)
+    assert fake_pipeline["jobs"] == ["job - bad.pdf", "job (2 documents)"]
+    assert fake_pipeline["documents"][1]["name"] == "job (2 documents).pdf"
+
+
+def test_single_source_group_applies_the_size_limit(tmp_path, fake_pipeline):
+    group = CoalesceGroup("printer", 0)
+    group.sources = [write_pdf(tmp_path / "a.pdf")]
+    with pytest.raises(RuntimeError, match="byte limit"):
+        up_print.submit_coalesced_group("token", group, "job", capabilities=PDF_ONLY, max_bytes=10)
+    assert fake_pipeline["jobs"] == []
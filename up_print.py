@@ -4,9 +4,23 @@ import os
 import sys
 import time
 import mimetypes
+import re
 import json
 import base64
-from typing import Dict, Optional, Tuple, Any, List
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple, Any, List, Iterator, Deque, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
 
 import msal
 import requests
@@ -16,6 +30,7 @@ from dotenv import load_dotenv
 GRAPH_SCOPE = ["https://graph.microsoft.com/.default"]
 GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
 REQUIRED_APP_ROLES = {"Printer.Read.All", "PrintJob.ReadWrite.All", "PrintJob.Manage.All"}
+TERMINAL_JOB_STATES = {"completed", "aborted", "canceled", "failed"}
 
 # Ensure uncommon but relevant types are recognized by extension
 mimetypes.add_type("application/oxps", ".oxps")
@@ -31,14 +46,97 @@ def load_env() -> None:
     load_dotenv(override=False)
 
 
-def get_access_token(tenant_id: str, client_id: str, client_secret: str) -> str:
+@contextmanager
+def _token_cache_lock(cache_path: str) -> Iterator[None]:
+    """Hold an exclusive cross-process lock on `<cache_path>.lock`.
+
+    The lock covers load, token acquisition and save, so parallel workers on
+    one host wait for the first one to fetch a token and then reuse it.
+    """
+    lock_path = f"{cache_path}.lock"
+    directory = os.path.dirname(os.path.abspath(lock_path))
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+def _load_token_cache(cache_path: str) -> msal.SerializableTokenCache:
+    token_cache = msal.SerializableTokenCache()
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                token_cache.deserialize(f.read())
+        except Exception:  # noqa: BLE001
+            pass
+    return token_cache
+
+
+def _save_token_cache(token_cache: msal.SerializableTokenCache, cache_path: str) -> None:
+    """Persist the cache only if MSAL changed it, replacing the file atomically."""
+    if not token_cache.has_state_changed:
+        return
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".msal_cache_", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(token_cache.serialize())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, cache_path)
+        token_cache.has_state_changed = False
+    except Exception:  # noqa: BLE001
+        # serialize() clears the flag; keep the cache dirty so the next save retries
+        token_cache.has_state_changed = True
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def _shared_token_cache(cache_path: Optional[str]) -> Iterator[Optional[msal.SerializableTokenCache]]:
+    """Yield a token cache backed by `cache_path`, locked for the duration.
+
+    Yields None (no persistence) when `cache_path` is empty.
+    """
+    if not cache_path:
+        yield None
+        return
+    with _token_cache_lock(cache_path):
+        token_cache = _load_token_cache(cache_path)
+        yield token_cache
+        _save_token_cache(token_cache, cache_path)
+
+
+def get_access_token(tenant_id: str, client_id: str, client_secret: str, cache_path: Optional[str] = None) -> str:
     authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = msal.ConfidentialClientApplication(
-        client_id=client_id,
-        client_credential=client_secret,
-        authority=authority,
-    )
-    result = app.acquire_token_for_client(scopes=GRAPH_SCOPE)
+    with _shared_token_cache(cache_path) as token_cache:
+        app = msal.ConfidentialClientApplication(
+            client_id=client_id,
+            client_credential=client_secret,
+            authority=authority,
+            token_cache=token_cache,
+        )
+        result = app.acquire_token_for_client(scopes=GRAPH_SCOPE)
     if "access_token" not in result:
         raise RuntimeError(f"Failed to acquire token: {result}")
     return result["access_token"]
@@ -46,36 +144,24 @@ def get_access_token(tenant_id: str, client_id: str, client_secret: str) -> str:
 
 def get_user_token_device_code(tenant_id: str, client_id: str, scopes: List[str], cache_path: Optional[str] = None) -> str:
     authority = f"https://login.microsoftonline.com/{tenant_id}"
-    token_cache: Optional[msal.SerializableTokenCache] = None
-    if cache_path:
-        token_cache = msal.SerializableTokenCache()
-        if os.path.exists(cache_path):
-            try:
-                token_cache.deserialize(open(cache_path, "r").read())
-            except Exception:  # noqa: BLE001
-                pass
-    app = msal.PublicClientApplication(
-        client_id=client_id,
-        authority=authority,
-        token_cache=token_cache,
-    )
-    accounts = app.get_accounts()
-    result: Optional[Dict[str, Any]] = None
-    if accounts:
-        result = app.acquire_token_silent(scopes, account=accounts[0])
-    if not result:
-        flow = app.initiate_device_flow(scopes=scopes)
-        if "user_code" not in flow:
-            raise RuntimeError(f"Failed to initiate device code flow: {flow}")
-        print(flow["message"])  # prompts user to visit URL and enter code
-        result = app.acquire_token_by_device_flow(flow)
+    with _shared_token_cache(cache_path) as token_cache:
+        app = msal.PublicClientApplication(
+            client_id=client_id,
+            authority=authority,
+            token_cache=token_cache,
+        )
+        accounts = app.get_accounts()
+        result: Optional[Dict[str, Any]] = None
+        if accounts:
+            result = app.acquire_token_silent(scopes, account=accounts[0])
+        if not result:
+            flow = app.initiate_device_flow(scopes=scopes)
+            if "user_code" not in flow:
+                raise RuntimeError(f"Failed to initiate device code flow: {flow}")
+            print(flow["message"])  # prompts user to visit URL and enter code
+            result = app.acquire_token_by_device_flow(flow)
     if not result or "access_token" not in result:
         raise RuntimeError(f"Failed to acquire user token: {result}")
-    if token_cache and cache_path:
-        try:
-            open(cache_path, "w").write(token_cache.serialize())
-        except Exception:  # noqa: BLE001
-            pass
     return result["access_token"]
 
 
@@ -115,6 +201,34 @@ def debug_print_token_claims(token: str) -> None:
         print(f"[debug] token.scp={scopes}", file=sys.stderr)
 
 
+class CachedToken:
+    """Hold an access token and fetch a new one five minutes before it expires.
+
+    Long-running modes (watch daemon, fleet refresh, tenants) call `get()` per
+    job instead of keeping the token from startup, which expires after ~1h.
+    """
+
+    def __init__(self, fetch: Callable[[], str]) -> None:
+        self._fetch = fetch
+        self._token: Optional[str] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token and time.time() < self._expires:
+                return self._token
+            token = self._fetch()
+            claims = decode_jwt_without_validation(token) or {}
+            self._token = token
+            self._expires = float(claims.get("exp") or time.time() + 3000) - 300
+            return token
+
+    def clear(self) -> None:
+        with self._lock:
+            self._token = None
+
+
 def _extract_graph_error(resp: requests.Response) -> Dict[str, Any]:
     details: Dict[str, Any] = {
         "status_code": resp.status_code,
@@ -172,6 +286,337 @@ def graph_headers(token: str) -> Dict[str, str]:
     }
 
 
+class LatencyTracker:
+    """Rolling latency samples per operation, used to pick hedge delays."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20, default_delay: float = 1.0, min_delay: float = 0.05) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = self._samples[operation] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, operation: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(operation) or ())
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self, operation: str) -> float:
+        p95 = self.percentile(operation, 95)
+        return self.default_delay if p95 is None else max(self.min_delay, p95)
+
+
+REQUEST_LATENCY = LatencyTracker()
+HEDGE_STATS = {"sent": 0, "won": 0}
+_HEDGE_STATS_LOCK = threading.Lock()
+_HEDGING = {"enabled": False}
+
+
+def configure_hedging(enabled: bool, default_delay: Optional[float] = None) -> None:
+    """Turn hedging of idempotent reads on or off for this process."""
+    _HEDGING["enabled"] = enabled
+    if default_delay is not None:
+        REQUEST_LATENCY.default_delay = default_delay
+
+
+def _retry_after_seconds(resp: requests.Response, default: float = 5.0) -> float:
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _remaining_timeout(timeout: float, deadline: Optional[float], operation: str) -> float:
+    """Clamp a per-call timeout to what is left of a `time.monotonic()` deadline."""
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"Deadline exceeded before {operation}")
+    return min(timeout, remaining)
+
+
+_SECRET_QUERY_PARAM = re.compile(r"(?i)\b(tempauthtoken|access_token|token|sig|code)=([^&\"'\s]+)")
+_REDACTED = "REDACTED"
+
+
+def _redact(text: str) -> str:
+    """Blank out credentials embedded in URLs (e.g. upload `tempauthtoken`)."""
+    return _SECRET_QUERY_PARAM.sub(lambda m: f"{m.group(1)}={_REDACTED}", text)
+
+
+class Cassette:
+    """Recorded HTTP exchanges, with credentials redacted, for offline replay."""
+
+    VERSION = 1
+
+    def __init__(self, exchanges: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.exchanges: List[Dict[str, Any]] = exchanges or []
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        kwargs: Dict[str, Any],
+        resp: Optional[requests.Response],
+        started: float,
+        elapsed: float,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Append one exchange: a response, or the `error` raised instead (e.g. a timeout)."""
+        headers = dict(kwargs.get("headers") or {})
+        if "Authorization" in headers:
+            headers["Authorization"] = f"Bearer {_REDACTED}"
+        body: Any = kwargs.get("json")
+        if body is None and kwargs.get("data") is not None:
+            body = {"bytes": len(kwargs["data"])}
+        exchange = {
+            "operation": operation,
+            "method": method,
+            "url": _redact(url),
+            "request_headers": headers,
+            "request_body": body,
+            "started": round(started - self._origin, 6),
+            "elapsed": round(elapsed, 6),
+        }
+        if resp is not None:
+            exchange["status"] = resp.status_code
+            exchange["headers"] = dict(resp.headers)
+            exchange["body"] = _redact(resp.content.decode("utf-8", errors="replace"))
+        else:
+            exchange["error"] = type(error).__name__
+            exchange["error_message"] = _redact(str(error))
+        with self._lock:
+            self.exchanges.append(exchange)
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {"version": self.VERSION, "exchanges": list(self.exchanges)}
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            raise RuntimeError(f"Unsupported cassette version in {path}: {data.get('version')}")
+        return cls(data.get("exchanges") or [])
+
+
+class ReplayTransport:
+    """Serve responses from a cassette at recorded (optionally scaled) latency.
+
+    Exchanges are matched by method and redacted URL in recorded order; the
+    last exchange for a URL is reused once the queue runs dry (e.g. extra
+    polling). A scaled latency beyond the call's timeout raises ReadTimeout,
+    and a recorded failure re-raises the same `requests` exception after its
+    recorded latency.
+    """
+
+    def __init__(self, cassette: Cassette, latency_scale: float = 1.0) -> None:
+        self.latency_scale = latency_scale
+        self._queues: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        for exchange in cassette.exchanges:
+            key = (exchange["method"], exchange["url"])
+            self._queues.setdefault(key, deque()).append(exchange)
+
+    def _next(self, method: str, url: str) -> Dict[str, Any]:
+        key = (method, _redact(url))
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise RuntimeError(f"No recorded response for {method} {key[1]}")
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def send(self, method: str, url: str, timeout: Optional[float] = None, **_: Any) -> requests.Response:
+        exchange = self._next(method, url)
+        delay = exchange.get("elapsed", 0.0) * self.latency_scale
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"Replayed {method} {url} exceeded timeout of {timeout:.1f}s")
+        if delay > 0:
+            time.sleep(delay)
+        if exchange.get("error"):
+            error_type = getattr(requests.exceptions, exchange["error"], None)
+            if not (isinstance(error_type, type) and issubclass(error_type, requests.exceptions.RequestException)):
+                error_type = requests.exceptions.RequestException
+            raise error_type(f"Replayed {exchange['error']}: {exchange.get('error_message', '')}")
+        resp = requests.Response()
+        resp.status_code = exchange["status"]
+        resp.headers.update(exchange.get("headers") or {})
+        resp._content = (exchange.get("body") or "").encode("utf-8")
+        resp.url = url
+        resp.elapsed = timedelta(seconds=delay)
+        return resp
+
+
+_TRANSPORT: Dict[str, Any] = {"recorder": None, "replay": None}
+# Tenant whose session, caches and throttle serve calls made in this context
+_ACTIVE_TENANT: "ContextVar[Optional[TenantContext]]" = ContextVar("up_active_tenant", default=None)
+
+
+def configure_transport(recorder: Optional[Cassette] = None, replay: Optional[ReplayTransport] = None) -> None:
+    """Record live exchanges into `recorder`, or serve them from `replay`."""
+    _TRANSPORT["recorder"] = recorder
+    _TRANSPORT["replay"] = replay
+
+
+def _timed_request(operation: str, method: str, url: str, **kwargs: Any) -> requests.Response:
+    replay: Optional[ReplayTransport] = _TRANSPORT["replay"]
+    tenant = _ACTIVE_TENANT.get()
+    started = time.monotonic()
+    if replay is not None:
+        resp = replay.send(method, url, **kwargs)
+    elif tenant is not None:
+        resp = tenant.session.request(method, url, **kwargs)
+    else:
+        resp = requests.request(method, url, **kwargs)
+    REQUEST_LATENCY.record(operation, time.monotonic() - started)
+    return resp
+
+
+def _request_in_thread(operation: str, method: str, url: str, **kwargs: Any) -> "Future[requests.Response]":
+    """Run `_timed_request` on its own daemon thread, in a copy of the caller's context.
+
+    A shared pool would make requests queue for a worker, and that queueing
+    would be measured as latency and trigger hedges that do not help.
+    """
+    future: "Future[requests.Response]" = Future()
+    context = copy_context()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(_timed_request, operation, method, url, **kwargs))
+        except BaseException as exc:  # noqa: BLE001
+            future.set_exception(exc)
+
+    threading.Thread(target=run, name=f"up-{operation}", daemon=True).start()
+    return future
+
+
+def _hedged_request(operation: str, method: str, url: str, deadline: Optional[float], **kwargs: Any) -> requests.Response:
+    """Send a request and, if it is slower than the adaptive p95, a second copy.
+
+    Whichever response arrives first wins; the loser is left to finish in the
+    background. Only use for idempotent reads.
+    """
+    # Thread.start() returns once the thread runs, so the hedge timer starts with the request
+    first = _request_in_thread(operation, method, url, **kwargs)
+    delay = REQUEST_LATENCY.hedge_delay(operation)
+    if deadline is not None:
+        delay = min(delay, max(0.0, deadline - time.monotonic()))
+    done, _ = wait([first], timeout=delay)
+    if done or (deadline is not None and time.monotonic() >= deadline):
+        return first.result()
+    # The hedge starts `delay` later, so re-clamp its timeout to what is left of the deadline
+    try:
+        hedge_kwargs = dict(kwargs, timeout=_remaining_timeout(kwargs["timeout"], deadline, operation))
+    except TimeoutError:
+        return first.result()
+    # A hedge is optional: skip it rather than wait when the tenant's budget is spent
+    tenant = _ACTIVE_TENANT.get()
+    if tenant is not None and not tenant.throttle.try_acquire():
+        return first.result()
+
+    second = _request_in_thread(operation, method, url, **hedge_kwargs)
+    with _HEDGE_STATS_LOCK:
+        HEDGE_STATS["sent"] += 1
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                resp = future.result()
+            except Exception as exc:  # noqa: BLE001
+                error = exc
+                continue
+            if future is second:
+                with _HEDGE_STATS_LOCK:
+                    HEDGE_STATS["won"] += 1
+            return resp
+    assert error is not None
+    raise error
+
+
+THROTTLE_RETRIES = 3
+
+
+def _send_request(
+    method: str,
+    url: str,
+    operation: str,
+    timeout: float,
+    deadline: Optional[float] = None,
+    idempotent: bool = False,
+    **kwargs: Any,
+) -> requests.Response:
+    """Single choke point for HTTP calls.
+
+    In tenant mode the tenant's request budget is taken first. The per-call
+    `timeout` is then clamped to the remaining `deadline` (absolute
+    `time.monotonic()` value), and idempotent reads are hedged when hedging is
+    enabled via `configure_hedging`. A 429 (and a 503 for idempotent reads)
+    is retried after its Retry-After, pausing the tenant's budget on 429, up
+    to THROTTLE_RETRIES times unless the wait would pass the deadline; the
+    last response is returned otherwise.
+
+    Only the outcome the caller receives is recorded to the cassette: one
+    entry per attempt, whether a response or a `requests` exception such as a
+    timeout, and never a losing hedge. Hedging is off in replay, so each
+    recorded exchange answers exactly one call.
+    """
+    recorder: Optional[Cassette] = _TRANSPORT["recorder"]
+    hedge = idempotent and _HEDGING["enabled"] and _TRANSPORT["replay"] is None
+    tenant = _ACTIVE_TENANT.get()
+    retry_statuses = (429, 503) if idempotent else (429,)
+    attempt = 0
+    while True:
+        if tenant is not None:
+            tenant.throttle.acquire(deadline=deadline)
+        kwargs["timeout"] = _remaining_timeout(timeout, deadline, operation)
+        started = time.monotonic()
+        try:
+            if hedge:
+                resp = _hedged_request(operation, method, url, deadline, **kwargs)
+            else:
+                resp = _timed_request(operation, method, url, **kwargs)
+        except requests.exceptions.RequestException as exc:
+            if recorder is not None:
+                recorder.record(operation, method, url, kwargs, None, started, time.monotonic() - started, error=exc)
+            raise
+        if recorder is not None:
+            recorder.record(operation, method, url, kwargs, resp, started, time.monotonic() - started)
+        if resp.status_code not in retry_statuses:
+            return resp
+        retry_after = _retry_after_seconds(resp)
+        if tenant is not None and resp.status_code == 429:
+            tenant.throttle.pause(retry_after)
+        if attempt >= THROTTLE_RETRIES or (deadline is not None and time.monotonic() + retry_after >= deadline):
+            return resp
+        attempt += 1
+        if tenant is None or resp.status_code != 429:
+            time.sleep(retry_after)
+
+
 def _sniff_magic_content_type(file_path: str) -> Optional[str]:
     """Best-effort magic-byte MIME sniffing for common printable formats.
 
@@ -245,7 +690,7 @@ def _noop() -> None:
     return None
 
 
-def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, retry_count: int = 2) -> List[Dict[str, Any]]:
+def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, retry_count: int = 2, deadline: Optional[float] = None) -> List[Dict[str, Any]]:
     """Discover all shares for a given printer.
     
     Returns a list of share objects that reference this printer.
@@ -259,12 +704,12 @@ def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, r
             if debug and attempt > 0:
                 print(f"[debug] shares discovery attempt {attempt + 1}/{retry_count + 1}", file=sys.stderr)
             
-            shares_resp = requests.get(shares_url, headers=graph_headers(token), timeout=30)
+            shares_resp = _send_request("GET", shares_url, "list shares", 30, deadline=deadline, idempotent=True, headers=graph_headers(token))
             
             if shares_resp.status_code != 200:
                 if debug:
                     print(f"[debug] shares discovery failed: {_build_graph_error_message('List shares', shares_resp)}", file=sys.stderr)
-                if attempt < retry_count:
+                if attempt < retry_count and (deadline is None or time.monotonic() + 2 < deadline):
                     time.sleep(2)  # Wait before retry
                     continue
                 return []
@@ -289,6 +734,8 @@ def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, r
             
             if matching_shares or attempt >= retry_count:
                 return matching_shares
+            if deadline is not None and time.monotonic() + 2 >= deadline:
+                return matching_shares
             
             # No matches found, wait and retry
             if debug:
@@ -298,6 +745,8 @@ def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, r
         except Exception as e:  # noqa: BLE001
             if debug:
                 print(f"[debug] exception discovering shares: {e}", file=sys.stderr)
+            if isinstance(e, TimeoutError):
+                return []
             if attempt < retry_count:
                 time.sleep(2)
                 continue
@@ -306,7 +755,7 @@ def _discover_printer_shares(token: str, printer_id: str, debug: bool = False, r
     return []
 
 
-def create_print_job(token: str, printer_id: str, job_name: str, job_configuration: Optional[Dict[str, Any]] = None, debug: bool = False, share_id: Optional[str] = None) -> Tuple[Dict, Optional[str]]:
+def create_print_job(token: str, printer_id: str, job_name: str, job_configuration: Optional[Dict[str, Any]] = None, debug: bool = False, share_id: Optional[str] = None, deadline: Optional[float] = None) -> Tuple[Dict, Optional[str]]:
     """Create a print job, optionally via a share endpoint.
     
     Returns tuple of (job_dict, share_id_used).
@@ -326,7 +775,7 @@ def create_print_job(token: str, printer_id: str, job_name: str, job_configurati
     if job_configuration:
         payload["configuration"] = job_configuration
     
-    resp = requests.post(url, headers=graph_headers(token), json=payload, timeout=60)
+    resp = _send_request("POST", url, "create job", 60, deadline=deadline, headers=graph_headers(token), json=payload)
     if resp.status_code not in (200, 201):
         raise RuntimeError(_build_graph_error_message("Create job", resp))
     
@@ -341,8 +790,11 @@ def create_document_and_upload_session(
     content_type: Optional[str],
     debug: bool = False,
     share_id: Optional[str] = None,
+    deadline: Optional[float] = None,
+    document_name: Optional[str] = None,
 ) -> Tuple[str, str]:
-    file_name = os.path.basename(file_path)
+    # `document_name` is shown on the printed job; uploads of converted temp files pass the user's name
+    file_name = document_name or os.path.basename(file_path)
     effective_content_type, ctype_source = detect_content_type(file_path, content_type, debug=debug)
     if debug:
         try:
@@ -354,7 +806,7 @@ def create_document_and_upload_session(
     if debug:
         try:
             printer_job_url = f"{GRAPH_BASE_URL}/print/printers/{printer_id}/jobs/{job_id}?$select=id,createdDateTime,status"
-            printer_job_resp = requests.get(printer_job_url, headers=graph_headers(token), timeout=30)
+            printer_job_resp = _send_request("GET", printer_job_url, "get job", 30, deadline=deadline, idempotent=True, headers=graph_headers(token))
             if printer_job_resp.status_code == 200:
                 job_meta = printer_job_resp.json() or {}
                 print(f"[debug] job ok: {job_meta.get('id')}", file=sys.stderr)
@@ -368,13 +820,13 @@ def create_document_and_upload_session(
         
         # Also try to access via the shares endpoint as alternative
         try:
-            matching_shares = _discover_printer_shares(token, printer_id, debug=debug)
+            matching_shares = _discover_printer_shares(token, printer_id, debug=debug, deadline=deadline)
             if matching_shares:
                 share_id = matching_shares[0].get("id")
                 print(f"[debug] discovered printer share: {share_id}", file=sys.stderr)
                 # Try to access job via share endpoint
                 share_job_url = f"{GRAPH_BASE_URL}/print/shares/{share_id}/jobs/{job_id}?$select=id,createdDateTime,status"
-                share_job_resp = requests.get(share_job_url, headers=graph_headers(token), timeout=30)
+                share_job_resp = _send_request("GET", share_job_url, "get job", 30, deadline=deadline, idempotent=True, headers=graph_headers(token))
                 if share_job_resp.status_code == 200:
                     print(f"[debug] job accessible via share endpoint", file=sys.stderr)
                 else:
@@ -404,7 +856,7 @@ def create_document_and_upload_session(
                 print(f"[debug] body={json.dumps(collection_payload, separators=(',', ':'), ensure_ascii=False)}", file=sys.stderr)
             except Exception:  # noqa: BLE001
                 pass
-        session_resp = requests.post(collection_session_url, headers=graph_headers(token), json=collection_payload, timeout=60)
+        session_resp = _send_request("POST", collection_session_url, "create upload session", 60, deadline=deadline, headers=graph_headers(token), json=collection_payload)
         if session_resp.status_code in (200, 201):
             upload_session = session_resp.json() or {}
             # Try multiple shapes for document id for robustness across API surfaces
@@ -428,6 +880,8 @@ def create_document_and_upload_session(
             except Exception:  # noqa: BLE001
                 pass
     except Exception as e:  # noqa: BLE001
+        if isinstance(e, TimeoutError):
+            raise
         if debug:
             print(f"[debug] Strategy 1 exception: {e}", file=sys.stderr)
 
@@ -447,7 +901,7 @@ def create_document_and_upload_session(
         except Exception:  # noqa: BLE001
             pass
     
-    doc_resp = requests.post(doc_url, headers=graph_headers(token), json=doc_payload, timeout=60)
+    doc_resp = _send_request("POST", doc_url, "create document", 60, deadline=deadline, headers=graph_headers(token), json=doc_payload)
     
     # Strategy 2 failed, try Strategy 3: Use shares endpoint if we haven't already
     if doc_resp.status_code not in (200, 201):
@@ -467,7 +921,7 @@ def create_document_and_upload_session(
                     print(f"[debug] Strategy 3: Attempting via printer share endpoint", file=sys.stderr)
                 
                 # Discover the share ID for this printer
-                matching_shares = _discover_printer_shares(token, printer_id, debug=debug)
+                matching_shares = _discover_printer_shares(token, printer_id, debug=debug, deadline=deadline)
                 
                 if matching_shares:
                     discovered_share_id = matching_shares[0].get("id")
@@ -479,7 +933,7 @@ def create_document_and_upload_session(
                     if debug:
                         print(f"[debug] POST {share_doc_url}", file=sys.stderr)
                     
-                    share_doc_resp = requests.post(share_doc_url, headers=graph_headers(token), json=doc_payload, timeout=60)
+                    share_doc_resp = _send_request("POST", share_doc_url, "create document", 60, deadline=deadline, headers=graph_headers(token), json=doc_payload)
                     
                     if share_doc_resp.status_code in (200, 201):
                         if debug:
@@ -493,6 +947,8 @@ def create_document_and_upload_session(
                     if debug:
                         print(f"[debug] Strategy 3 skipped: no shares found", file=sys.stderr)
             except Exception as e:  # noqa: BLE001
+                if isinstance(e, TimeoutError):
+                    raise
                 if debug:
                     print(f"[debug] Strategy 3 exception: {e}", file=sys.stderr)
         else:
@@ -561,7 +1017,7 @@ def create_document_and_upload_session(
             print(f"[debug] Creating upload session (via {endpoint_type}): POST {session_url} body={{}}", file=sys.stderr)
         except Exception:  # noqa: BLE001
             pass
-    session_resp = requests.post(session_url, headers=graph_headers(token), json={}, timeout=60)
+    session_resp = _send_request("POST", session_url, "create upload session", 60, deadline=deadline, headers=graph_headers(token), json={})
     if session_resp.status_code not in (200, 201):
         raise RuntimeError(_build_graph_error_message("Create upload session", session_resp))
     upload_session = session_resp.json() or {}
@@ -572,7 +1028,13 @@ def create_document_and_upload_session(
     return document_id, upload_url
 
 
-def upload_file_to_upload_session(upload_url: str, file_path: str, chunk_size: int = 4 * 1024 * 1024) -> None:
+def upload_file_to_upload_session(
+    upload_url: str,
+    file_path: str,
+    chunk_size: int = 4 * 1024 * 1024,
+    deadline: Optional[float] = None,
+    bandwidth: Optional["TokenBucket"] = None,
+) -> None:
     total_size = os.path.getsize(file_path)
     bytes_uploaded = 0
     with open(file_path, "rb") as f:
@@ -587,7 +1049,9 @@ def upload_file_to_upload_session(upload_url: str, file_path: str, chunk_size: i
                 "Content-Range": f"bytes {start}-{end}/{total_size}",
                 "Content-Type": "application/octet-stream",
             }
-            put_resp = requests.put(upload_url, headers=headers, data=chunk, timeout=300)
+            if bandwidth is not None:
+                bandwidth.acquire(len(chunk), deadline=deadline)
+            put_resp = _send_request("PUT", upload_url, "upload chunk", 300, deadline=deadline, headers=headers, data=chunk)
             if put_resp.status_code not in (200, 201, 202):
                 raise RuntimeError(
                     f"Upload chunk failed: {put_resp.status_code} {put_resp.text} at range {start}-{end}"
@@ -595,7 +1059,7 @@ def upload_file_to_upload_session(upload_url: str, file_path: str, chunk_size: i
             bytes_uploaded = end + 1
 
 
-def start_print_job(token: str, printer_id: str, job_id: str, share_id: Optional[str] = None, debug: bool = False) -> None:
+def start_print_job(token: str, printer_id: str, job_id: str, share_id: Optional[str] = None, debug: bool = False, deadline: Optional[float] = None) -> None:
     """Start a print job, optionally via a share endpoint."""
     if share_id:
         url = f"{GRAPH_BASE_URL}/print/shares/{share_id}/jobs/{job_id}/start"
@@ -606,14 +1070,14 @@ def start_print_job(token: str, printer_id: str, job_id: str, share_id: Optional
         if debug:
             print(f"[debug] starting job via printer: {printer_id}", file=sys.stderr)
     
-    resp = requests.post(url, headers=graph_headers(token), json={}, timeout=60)
+    resp = _send_request("POST", url, "start job", 60, deadline=deadline, headers=graph_headers(token), json={})
     if resp.status_code not in (200, 202, 204):
         raise RuntimeError(_build_graph_error_message("Start job", resp))
 
 
-def get_job(token: str, printer_id: str, job_id: str) -> Dict:
+def get_job(token: str, printer_id: str, job_id: str, deadline: Optional[float] = None) -> Dict:
     url = f"{GRAPH_BASE_URL}/print/printers/{printer_id}/jobs/{job_id}"
-    resp = requests.get(url, headers=graph_headers(token), timeout=60)
+    resp = _send_request("GET", url, "get job", 60, deadline=deadline, idempotent=True, headers=graph_headers(token))
     if resp.status_code != 200:
         raise RuntimeError(_build_graph_error_message("Get job", resp))
     return resp.json()
@@ -632,20 +1096,43 @@ def poll_until_completed(token: str, printer_id: str, job_id: str, interval_seco
         job = get_job(token, printer_id, job_id)
         state, description = extract_job_state(job)
         print(f"Job {job_id} state: {state}{' - ' + description if description else ''}")
-        if state in {"completed", "aborted", "canceled", "failed"}:
+        if state in TERMINAL_JOB_STATES:
             return
         time.sleep(interval_seconds)
     raise TimeoutError("Timed out waiting for job to complete")
 
 
-def _get_printer_defaults(token: str, printer_id: str, debug: bool = False) -> Dict[str, Any]:
+def preflight_printer(token: str, printer_id: str, debug: bool = False, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Confirm the printer exists and is readable; raises with Graph details otherwise."""
+    preflight = _send_request(
+        "GET",
+        f"{GRAPH_BASE_URL}/print/printers/{printer_id}?$select=id,displayName,manufacturer,model",
+        "preflight",
+        30,
+        deadline=deadline,
+        idempotent=True,
+        headers=graph_headers(token),
+    )
+    if preflight.status_code == 404:
+        raise RuntimeError(_build_graph_error_message("Validate printer (not found)", preflight))
+    if preflight.status_code == 403:
+        raise RuntimeError(_build_graph_error_message("Validate printer (forbidden)", preflight))
+    if preflight.status_code != 200:
+        raise RuntimeError(_build_graph_error_message("Validate printer", preflight))
+    meta = preflight.json() or {}
+    if debug:
+        print(f"[debug] printer ok: {meta.get('id')} {meta.get('displayName')}", file=sys.stderr)
+    return meta
+
+
+def _get_printer_defaults(token: str, printer_id: str, debug: bool = False, deadline: Optional[float] = None) -> Dict[str, Any]:
     """Fetch printer defaults for use in job configuration.
 
     Tries to read `defaults` from the printer resource. Returns an empty dict
     on failure so callers can decide how to proceed.
     """
     url = f"{GRAPH_BASE_URL}/print/printers/{printer_id}?$select=defaults"
-    resp = requests.get(url, headers=graph_headers(token), timeout=30)
+    resp = _send_request("GET", url, "get defaults", 30, deadline=deadline, idempotent=True, headers=graph_headers(token))
     if resp.status_code != 200:
         if debug:
             print(f"[debug] could not fetch printer defaults: {_build_graph_error_message('Get printer defaults', resp)}", file=sys.stderr)
@@ -660,13 +1147,28 @@ def _get_printer_defaults(token: str, printer_id: str, debug: bool = False) -> D
     return defaults
 
 
-def _get_printer_capabilities(token: str, printer_id: str, debug: bool = False) -> Dict[str, Any]:
+_METADATA_CACHES: Dict[str, Dict[str, Any]] = {}
+
+
+def _metadata_cache(name: str) -> Dict[str, Any]:
+    """Per-printer metadata cache for the active tenant (or the process default)."""
+    tenant = _ACTIVE_TENANT.get()
+    caches = tenant.metadata if tenant is not None else _METADATA_CACHES
+    return caches.setdefault(name, {})
+
+
+def _get_printer_capabilities(token: str, printer_id: str, debug: bool = False, deadline: Optional[float] = None) -> Dict[str, Any]:
     """Fetch printer capabilities to check supported content types.
 
-    Returns an empty dict on failure so callers can decide how to proceed.
+    Successful lookups are cached per printer (and per tenant in multi-tenant
+    mode). Returns an empty dict on failure so callers can decide how to proceed.
     """
+    cache = _metadata_cache("capabilities")
+    cached = cache.get(printer_id)
+    if cached is not None:
+        return cached
     url = f"{GRAPH_BASE_URL}/print/printers/{printer_id}?$select=capabilities"
-    resp = requests.get(url, headers=graph_headers(token), timeout=30)
+    resp = _send_request("GET", url, "get capabilities", 30, deadline=deadline, idempotent=True, headers=graph_headers(token))
     if resp.status_code != 200:
         if debug:
             print(f"[debug] could not fetch printer capabilities: {_build_graph_error_message('Get printer capabilities', resp)}", file=sys.stderr)
@@ -682,6 +1184,7 @@ def _get_printer_capabilities(token: str, printer_id: str, debug: bool = False)
                 print(f"[debug] printer capabilities: {json.dumps(capabilities, separators=(',', ':'), ensure_ascii=False)}", file=sys.stderr)
         except Exception:  # noqa: BLE001
             pass
+    cache[printer_id] = capabilities
     return capabilities
 
 
@@ -717,69 +1220,1320 @@ def _build_job_configuration_from_defaults(defaults: Dict[str, Any]) -> Dict[str
     return configuration
 
 
-def main() -> int:
-    load_env()
+def _printer_accepts_content_type(capabilities: Dict[str, Any], content_type: str) -> bool:
+    """Check a content type against the printer's advertised `contentTypes`.
 
-    parser = argparse.ArgumentParser(description="Create and start a Universal Print job via Microsoft Graph")
-    parser.add_argument("--printer-id", default=os.getenv("PRINTER_ID"), help="Printer ID in Universal Print")
-    parser.add_argument("--file", default=os.getenv("FILE_PATH"), help="Path to the file to print")
-    parser.add_argument("--job-name", default="UP Job", help="Display name for the print job")
-    parser.add_argument("--content-type", default=os.getenv("CONTENT_TYPE"), help="MIME type of the document (e.g., application/pdf)")
-    parser.add_argument("--poll", action="store_true", help="Poll job status until completion")
-    parser.add_argument("--debug", action="store_true", help="Print token claims and verbose diagnostics")
-    parser.add_argument("--auth", choices=["app", "device"], default=os.getenv("AUTH", "app"), help="Authentication mode: app (client credentials) or device (device code delegated)")
-    parser.add_argument("--scopes", nargs="*", default=os.getenv("SCOPES", "Printer.Read.All PrintJob.ReadWrite.All PrintJob.Manage.All offline_access").split(), help="Delegated scopes for device auth (space-separated)")
-    parser.add_argument("--cache-path", default=os.getenv("MSAL_CACHE_PATH", os.path.expanduser("~/.msal_up_cli_cache.json")), help="Path to MSAL token cache for device auth")
-    parser.add_argument("--tenant-id", default=os.getenv("TENANT_ID"), help="Azure AD tenant ID")
-    parser.add_argument("--client-id", default=os.getenv("CLIENT_ID"), help="App registration client ID")
-    parser.add_argument("--client-secret", default=os.getenv("CLIENT_SECRET"), help="App registration client secret")
-    args = parser.parse_args()
+    Printers that do not advertise content types are assumed to accept it.
+    """
+    content_types = capabilities.get("contentTypes") or []
+    if not content_types:
+        return True
+    wanted = content_type.split(";")[0].strip().lower()
+    return any(str(ct).split(";")[0].strip().lower() == wanted for ct in content_types)
 
-    required_base = [
-        ("--tenant-id", args.tenant_id),
-        ("--client-id", args.client_id),
-        ("--printer-id", args.printer_id),
-        ("--file", args.file),
-    ]
+
+def validate_job_configuration(job_configuration: Dict[str, Any], capabilities: Dict[str, Any]) -> None:
+    """Reject a job configuration the printer does not advertise support for.
+
+    Only capabilities present in the printer resource are checked, so printers
+    that publish little or nothing are not blocked.
+    """
+    problems: List[str] = []
+    checks = (
+        ("mediaSize", "mediaSizes"),
+        ("duplexMode", "duplexModes"),
+        ("colorMode", "colorModes"),
+    )
+    for config_key, capability_key in checks:
+        value = job_configuration.get(config_key)
+        supported = capabilities.get(capability_key) or []
+        if value is not None and supported and value not in supported:
+            problems.append(f"{config_key}={value} (supported: {', '.join(map(str, supported))})")
+    copies = job_configuration.get("copies")
+    copies_range = capabilities.get("copiesPerJob") or {}
+    if copies is not None and isinstance(copies_range, dict):
+        start = copies_range.get("start")
+        end = copies_range.get("end")
+        if (start is not None and copies < start) or (end is not None and copies > end):
+            problems.append(f"copies={copies} (supported: {start}-{end})")
+    if problems:
+        raise RuntimeError(f"Job configuration not supported by printer: {'; '.join(problems)}")
+
+
+def convert_image_to_pdf(file_path: str, output_path: str) -> None:
+    """Render an image (all frames, for multi-page TIFF) into a PDF.
+
+    Requires the optional `Pillow` package.
+    """
+    try:
+        from PIL import Image, ImageSequence
+    except ImportError as exc:
+        raise RuntimeError("Converting images to PDF requires the optional 'Pillow' package (pip install Pillow)") from exc
+
+    with Image.open(file_path) as img:
+        dpi = img.info.get("dpi") or (72, 72)
+        frames = [frame.convert("RGB") for frame in ImageSequence.Iterator(img)]
+    frames[0].save(output_path, "PDF", save_all=True, append_images=frames[1:], resolution=float(dpi[0]))
+
+
+def prepare_document_for_printer(
+    file_path: str,
+    content_type: Optional[str],
+    capabilities: Dict[str, Any],
+    max_bytes: Optional[int] = None,
+    debug: bool = False,
+) -> Tuple[str, str, Optional[str]]:
+    """Check a document against printer capabilities before any job is created.
+
+    Returns (path_to_upload, content_type, temp_path). Images the printer
+    cannot take are converted to PDF when it accepts PDF; `temp_path` is the
+    converted file the caller must remove, or None. Anything else the printer
+    does not accept raises RuntimeError.
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        raise RuntimeError(f"Document is empty: {file_path}")
+    if max_bytes is not None and size > max_bytes:
+        raise RuntimeError(f"Document is {size} bytes, above the {max_bytes} byte limit: {file_path}")
+
+    effective_content_type, ctype_source = detect_content_type(file_path, content_type, debug=debug)
+    if _printer_accepts_content_type(capabilities, effective_content_type):
+        return file_path, effective_content_type, None
+
+    supported = ", ".join(map(str, capabilities.get("contentTypes") or []))
+    if effective_content_type.startswith("image/") and _printer_accepts_content_type(capabilities, "application/pdf"):
+        fd, pdf_path = tempfile.mkstemp(prefix="up_converted_", suffix=".pdf")
+        os.close(fd)
+        try:
+            convert_image_to_pdf(file_path, pdf_path)
+        except Exception:
+            os.remove(pdf_path)
+            raise
+        if debug:
+            print(f"[debug] converted {effective_content_type} to application/pdf (printer supports: {supported})", file=sys.stderr)
+        return pdf_path, "application/pdf", pdf_path
+
+    raise RuntimeError(
+        f"Printer does not accept {effective_content_type} (source={ctype_source}) for {file_path}; supported: {supported}"
+    )
+
+
+class CoalesceGroup:
+    """Pending set of small PDFs bound for a single printer."""
+
+    __slots__ = ("printer_id", "key", "sources", "total_bytes", "opened_at")
+
+    def __init__(self, printer_id: str, opened_at: float, key: Any = None) -> None:
+        self.printer_id = printer_id
+        self.key = key
+        self.sources: List[str] = []
+        self.total_bytes = 0
+        self.opened_at = opened_at
+
+
+class DocumentCoalescer:
+    """Group small PDF documents for the same printer into merged jobs.
+
+    A group is released when adding another document would exceed `max_bytes`
+    or `max_documents`, or once `window_seconds` have elapsed since its first
+    document arrived. Callers decide which documents are eligible; an optional
+    `key` keeps otherwise separate streams (e.g. priority classes) apart.
+    """
+
+    def __init__(self, max_bytes: int, max_documents: int, window_seconds: float) -> None:
+        self.max_bytes = max_bytes
+        self.max_documents = max_documents
+        self.window_seconds = window_seconds
+        self._groups: Dict[Tuple[str, Any], CoalesceGroup] = {}
+
+    def add(self, printer_id: str, file_path: str, size: int, now: Optional[float] = None, key: Any = None) -> List[CoalesceGroup]:
+        """Queue a document; returns groups that are ready to submit."""
+        now = time.time() if now is None else now
+        slot = (printer_id, key)
+        ready: List[CoalesceGroup] = []
+        group = self._groups.get(slot)
+        if group and (group.total_bytes + size > self.max_bytes or len(group.sources) >= self.max_documents):
+            ready.append(self._groups.pop(slot))
+            group = None
+        if group is None:
+            group = CoalesceGroup(printer_id, now, key)
+            self._groups[slot] = group
+        group.sources.append(file_path)
+        group.total_bytes += size
+        if len(group.sources) >= self.max_documents:
+            ready.append(self._groups.pop(slot))
+        return ready
+
+    def due(self, now: Optional[float] = None) -> List[CoalesceGroup]:
+        """Release groups whose time window has elapsed."""
+        now = time.time() if now is None else now
+        expired = [slot for slot, g in self._groups.items() if now - g.opened_at >= self.window_seconds]
+        return [self._groups.pop(slot) for slot in expired]
+
+    def flush(self) -> List[CoalesceGroup]:
+        """Release every pending group."""
+        groups = list(self._groups.values())
+        self._groups.clear()
+        return groups
+
+
+def _load_pypdf() -> Any:
+    try:
+        import pypdf
+    except ImportError as exc:
+        raise RuntimeError("Coalescing requires the optional 'pypdf' package (pip install pypdf)") from exc
+    return pypdf
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Open a PDF with pypdf and return its page count; RuntimeError if unreadable or empty."""
+    pypdf = _load_pypdf()
+    try:
+        page_count = len(pypdf.PdfReader(file_path).pages)
+    except Exception as exc:  # noqa: BLE001
+        raise RuntimeError(f"Cannot read PDF {file_path}: {exc}") from exc
+    if page_count == 0:
+        raise RuntimeError(f"PDF has no pages: {file_path}")
+    return page_count
+
+
+def merge_pdf_documents(sources: List[str], output_path: str) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """Concatenate PDFs into `output_path`.
+
+    Returns (placements, skipped): one placement per merged source with the
+    page range it occupies, and (source, error) for sources that could not be
+    read, so one bad file does not fail the rest. Nothing is written when
+    every source is skipped. Requires the optional `pypdf` package.
+    """
+    pypdf = _load_pypdf()
+    writer = pypdf.PdfWriter()
+    placements: List[Dict[str, Any]] = []
+    skipped: List[Tuple[str, str]] = []
+    next_page = 1
+    for source in sources:
+        try:
+            pages = list(pypdf.PdfReader(source).pages)
+            if not pages:
+                raise RuntimeError("PDF has no pages")
+        except Exception as exc:  # noqa: BLE001
+            skipped.append((source, str(exc)))
+            continue
+        for page in pages:
+            writer.add_page(page)
+        placements.append({"source": source, "first_page": next_page, "last_page": next_page + len(pages) - 1})
+        next_page += len(pages)
+    if placements:
+        with open(output_path, "wb") as f:
+            writer.write(f)
+    return placements, skipped
+
+
+def submit_document(
+    token: str,
+    printer_id: str,
+    file_path: str,
+    job_name: str,
+    content_type: Optional[str] = None,
+    job_configuration: Optional[Dict[str, Any]] = None,
+    share_id: Optional[str] = None,
+    debug: bool = False,
+    capabilities: Optional[Dict[str, Any]] = None,
+    max_bytes: Optional[int] = None,
+    deadline: Optional[float] = None,
+    bandwidth: Optional["TokenBucket"] = None,
+    document_name: Optional[str] = None,
+) -> str:
+    """Run the full job lifecycle for one document and return the job id.
+
+    When `capabilities` is given the document is validated (and converted if
+    needed) before the job is created, so incompatible input never leaves an
+    orphaned job behind. `deadline` (a `time.monotonic()` value) bounds every
+    call from job creation through start. `bandwidth` is a shared upload budget.
+    `document_name` is the name shown on the job (default: the file's name).
+    """
+    temp_path: Optional[str] = None
+    document_name = document_name or os.path.basename(file_path)
+    if capabilities is not None:
+        file_path, content_type, temp_path = prepare_document_for_printer(
+            file_path, content_type, capabilities, max_bytes=max_bytes, debug=debug
+        )
+        if temp_path:
+            # Converted to PDF: keep the user's file name, not the temp file's
+            document_name = f"{os.path.splitext(document_name)[0]}.pdf"
+    try:
+        job, job_share_id = create_print_job(
+            token,
+            printer_id,
+            job_name,
+            job_configuration=job_configuration or None,
+            debug=debug,
+            share_id=share_id,
+            deadline=deadline,
+        )
+        job_id = job.get("id")
+        if not job_id:
+            raise RuntimeError("Job ID missing in create job response")
+        print(f"Created job {job_id}")
+
+        # Upload document to the job
+        print("Uploading document...")
+        document_id, upload_url = create_document_and_upload_session(
+            token,
+            printer_id,
+            job_id,
+            file_path,
+            content_type,
+            debug=debug,
+            share_id=job_share_id,
+            deadline=deadline,
+            document_name=document_name,
+        )
+
+        upload_file_to_upload_session(upload_url, file_path, deadline=deadline, bandwidth=bandwidth)
+        print("Upload complete.")
+
+        # Start the job
+        print("Starting job...")
+        start_print_job(token, printer_id, job_id, share_id=job_share_id, debug=debug, deadline=deadline)
+        print("Job started.")
+    finally:
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    return job_id
+
+
+def submit_coalesced_group(
+    token: str,
+    group: CoalesceGroup,
+    job_name: str,
+    job_configuration: Optional[Dict[str, Any]] = None,
+    share_id: Optional[str] = None,
+    debug: bool = False,
+    capabilities: Optional[Dict[str, Any]] = None,
+    max_bytes: Optional[int] = None,
+    deadline: Optional[float] = None,
+    bandwidth: Optional["TokenBucket"] = None,
+) -> List[Dict[str, Any]]:
+    """Merge a coalesced group into one PDF and submit it as a single job.
+
+    Returns per-source records with the job id and page range of each source.
+    A single-document group is submitted as-is without merging. Sources that
+    cannot be merged are submitted on their own; a source that still fails
+    gets a record with `job_id` None and an `error` message instead of
+    failing the whole group.
+    """
+    def submit_alone(source: str) -> Dict[str, Any]:
+        job_id = submit_document(
+            token,
+            group.printer_id,
+            source,
+            f"{job_name} - {os.path.basename(source)}" if len(group.sources) > 1 else job_name,
+            "application/pdf",
+            job_configuration=job_configuration,
+            share_id=share_id,
+            debug=debug,
+            capabilities=capabilities,
+            max_bytes=max_bytes,
+            deadline=deadline,
+            bandwidth=bandwidth,
+        )
+        return {"source": source, "job_id": job_id, "first_page": None, "last_page": None}
+
+    if len(group.sources) == 1:
+        return [submit_alone(group.sources[0])]
+
+    fd, merged_path = tempfile.mkstemp(prefix="up_coalesced_", suffix=".pdf")
+    os.close(fd)
+    records: List[Dict[str, Any]] = []
+    try:
+        placements, skipped = merge_pdf_documents(group.sources, merged_path)
+        for source, error in skipped:
+            print(f"Warning: could not merge {source} ({error}); submitting it separately", file=sys.stderr)
+            try:
+                records.append(submit_alone(source))
+            except Exception as exc:  # noqa: BLE001
+                records.append({"source": source, "job_id": None, "first_page": None, "last_page": None, "error": str(exc)})
+        if len(placements) == 1:
+            records.append(submit_alone(placements[0]["source"]))
+            return records
+        if not placements:
+            return records
+        if debug:
+            print(f"[debug] merged {len(placements)} documents into {merged_path}", file=sys.stderr)
+        name = f"{job_name} ({len(placements)} documents)"
+        job_id = submit_document(
+            token,
+            group.printer_id,
+            merged_path,
+            name,
+            "application/pdf",
+            job_configuration=job_configuration,
+            share_id=share_id,
+            debug=debug,
+            capabilities=capabilities,
+            deadline=deadline,
+            bandwidth=bandwidth,
+            document_name=f"{name}.pdf",
+        )
+    except Exception as exc:  # noqa: BLE001
+        if not records:
+            raise
+        # Keep the outcome of sources already submitted on their own
+        merged = [source for source in group.sources if source not in {r["source"] for r in records}]
+        records.extend({"source": source, "job_id": None, "first_page": None, "last_page": None, "error": str(exc)} for source in merged)
+        return records
+    finally:
+        try:
+            os.remove(merged_path)
+        except OSError:
+            pass
+    print(f"Coalesced {len(placements)} documents into job {job_id}")
+    for placement in placements:
+        placement["job_id"] = job_id
+        print(f"  {placement['source']}: pages {placement['first_page']}-{placement['last_page']}")
+    return records + placements
+
+
+WATCH_OUTCOME_DIRS = ("done", "failed")
+
+
+def _list_watch_dir(watch_dir: str) -> List[str]:
+    """List non-hidden files under `watch_dir`, including subdirectories.
+
+    The top-level `done/` and `failed/` directories hold already handled
+    files and are skipped.
+    """
+    entries = []
+    for root, dirs, names in os.walk(watch_dir):
+        skipped = WATCH_OUTCOME_DIRS if root == watch_dir else ()
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in skipped)
+        for name in sorted(names):
+            if not name.startswith("."):
+                entries.append(os.path.join(root, name))
+    return entries
+
+
+def _archive_watch_file(watch_dir: str, file_path: str, outcome: str) -> str:
+    """Move a handled file to `watch_dir/<outcome>/`, keeping its relative path.
+
+    An existing file of the same name is never overwritten; a numeric suffix
+    is added instead. Returns the new path.
+    """
+    relative = os.path.relpath(file_path, watch_dir)
+    target = os.path.join(watch_dir, outcome, relative)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    stem, ext = os.path.splitext(target)
+    counter = 1
+    while os.path.exists(target):
+        target = f"{stem}.{counter}{ext}"
+        counter += 1
+    os.replace(file_path, target)
+    return target
+
+
+def _classify_watch_path(watch_dir: str, file_path: str, default_priority: str, default_submitter: str) -> Tuple[str, str]:
+    """Derive (priority, submitter) from a watched file's subdirectories.
+
+    A directory named after a priority class sets the priority and the first
+    other directory names the submitter: `inbox/high/picking/list.pdf` is a
+    high-priority job from `picking`.
+    """
+    priority, submitter = default_priority, None
+    relative_dir = os.path.relpath(os.path.dirname(file_path), watch_dir)
+    for part in relative_dir.split(os.sep):
+        if part in ("", "."):
+            continue
+        if part in PRIORITY_CLASSES:
+            priority = part
+        elif submitter is None:
+            submitter = part
+    return priority, submitter or default_submitter
+
+
+def _list_graph_collection(token: str, url: str, action: str) -> List[Dict[str, Any]]:
+    """GET a Graph collection, following `@odata.nextLink` until exhausted.
+
+    Each page is an idempotent read, so throttled (429) and unavailable (503)
+    pages are retried after Retry-After by `_send_request`.
+    """
+    items: List[Dict[str, Any]] = []
+    next_url: Optional[str] = url
+    while next_url:
+        resp = _send_request("GET", next_url, action.lower(), 30, idempotent=True, headers=graph_headers(token))
+        if resp.status_code != 200:
+            raise RuntimeError(_build_graph_error_message(action, resp))
+        data = resp.json() or {}
+        items.extend(data.get("value") or [])
+        next_url = data.get("@odata.nextLink")
+    return items
+
+
+def _parse_graph_datetime(value: Optional[str]) -> Optional[float]:
+    """Parse a Graph timestamp (up to 7 fractional digits, trailing Z) to epoch seconds."""
+    if not value:
+        return None
+    try:
+        text = value.replace("Z", "+00:00")
+        if "." in text:
+            head, rest = text.split(".", 1)
+            offset = rest.lstrip("0123456789")
+            fraction = rest[: len(rest) - len(offset)][:6]
+            text = f"{head}.{fraction}{offset}" if fraction else f"{head}{offset}"
+        parsed = datetime.fromisoformat(text)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    except ValueError:
+        return None
+
+
+class FleetJobRecord:
+    """Compact row for one job in a fleet snapshot."""
+
+    __slots__ = ("target_id", "job_id", "state", "created_at")
+
+    def __init__(self, target_id: str, job_id: str, state: str, created_at: Optional[float]) -> None:
+        self.target_id = target_id
+        self.job_id = job_id
+        self.state = state
+        self.created_at = created_at
+
+
+FLEET_AGE_BUCKETS: List[Tuple[str, float]] = [
+    ("<1m", 60),
+    ("1-5m", 300),
+    ("5-15m", 900),
+    ("15-60m", 3600),
+    ("1-4h", 4 * 3600),
+    (">4h", float("inf")),
+]
+
+
+class FleetSnapshot:
+    """In-memory table of jobs across every printer (or share) in the tenant.
+
+    Jobs are listed concurrently, capped at `max_workers`, with a narrow
+    `$select` and full `@odata.nextLink` paging. `refresh(max_age)` re-lists
+    only targets whose last listing is older than `max_age` seconds.
+    """
+
+    JOB_SELECT = "id,createdDateTime,status"
+
+    def __init__(self, token: str, source: str = "printers", max_workers: int = 8, debug: bool = False) -> None:
+        if source not in ("printers", "shares"):
+            raise ValueError(f"Unknown fleet source: {source}")
+        self.token = token
+        self.source = source
+        self.max_workers = max_workers
+        self.debug = debug
+        self.targets: Dict[str, str] = {}
+        self.records: Dict[str, List[FleetJobRecord]] = {}
+        self.refreshed_at: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    def discover_targets(self) -> int:
+        """Load the printer or share list; returns the number of targets."""
+        url = f"{GRAPH_BASE_URL}/print/{self.source}?$select=id,displayName"
+        targets = _list_graph_collection(self.token, url, f"List {self.source}")
+        self.targets = {t["id"]: t.get("displayName") or t["id"] for t in targets if t.get("id")}
+        # A target that only ever failed has an error but no records
+        for stale_id in (set(self.records) | set(self.errors)) - set(self.targets):
+            self.records.pop(stale_id, None)
+            self.refreshed_at.pop(stale_id, None)
+            self.errors.pop(stale_id, None)
+        return len(self.targets)
+
+    def _list_jobs(self, target_id: str) -> List[FleetJobRecord]:
+        url = f"{GRAPH_BASE_URL}/print/{self.source}/{target_id}/jobs?$select={self.JOB_SELECT}"
+        rows: List[FleetJobRecord] = []
+        for job in _list_graph_collection(self.token, url, "List jobs"):
+            state, _ = extract_job_state(job)
+            rows.append(FleetJobRecord(target_id, job.get("id") or "", sys.intern(state), _parse_graph_datetime(job.get("createdDateTime"))))
+        return rows
+
+    def refresh(self, max_age: Optional[float] = None) -> int:
+        """Re-list jobs for stale targets (all targets when `max_age` is None).
+
+        Returns the number of targets refreshed successfully.
+        """
+        now = time.time()
+        stale = [
+            target_id
+            for target_id in self.targets
+            if max_age is None or now - self.refreshed_at.get(target_id, 0.0) >= max_age
+        ]
+        refreshed = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as pool:
+            futures = {pool.submit(self._list_jobs, target_id): target_id for target_id in stale}
+            for future in as_completed(futures):
+                target_id = futures[future]
+                try:
+                    self.records[target_id] = future.result()
+                except Exception as exc:  # noqa: BLE001
+                    self.errors[target_id] = str(exc)
+                    if self.debug:
+                        print(f"[debug] listing jobs for {target_id} failed: {exc}", file=sys.stderr)
+                    continue
+                self.errors.pop(target_id, None)
+                self.refreshed_at[target_id] = time.time()
+                refreshed += 1
+        return refreshed
+
+    def job_count(self) -> int:
+        return sum(len(rows) for rows in self.records.values())
+
+    def state_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for rows in self.records.values():
+            for row in rows:
+                counts[row.state] = counts.get(row.state, 0) + 1
+        return counts
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Number of non-terminal jobs per target."""
+        return {
+            target_id: sum(1 for row in rows if row.state not in TERMINAL_JOB_STATES)
+            for target_id, rows in self.records.items()
+        }
+
+    def age_distribution(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Histogram of non-terminal job ages using FLEET_AGE_BUCKETS."""
+        now = time.time() if now is None else now
+        histogram = {label: 0 for label, _ in FLEET_AGE_BUCKETS}
+        histogram["unknown"] = 0
+        for rows in self.records.values():
+            for row in rows:
+                if row.state in TERMINAL_JOB_STATES:
+                    continue
+                if row.created_at is None:
+                    histogram["unknown"] += 1
+                    continue
+                age = now - row.created_at
+                for label, upper in FLEET_AGE_BUCKETS:
+                    if age < upper:
+                        histogram[label] += 1
+                        break
+        return histogram
+
+    def summary(self) -> Dict[str, Any]:
+        depth = self.queue_depth()
+        return {
+            "source": self.source,
+            "targets": len(self.targets),
+            "listed": len(self.records),
+            "failed": len(self.errors),
+            "jobs": self.job_count(),
+            "states": self.state_counts(),
+            "queue_depth": {
+                target_id: {"name": self.targets.get(target_id, target_id), "depth": count}
+                for target_id, count in sorted(depth.items(), key=lambda item: -item[1])
+            },
+            "age_distribution": self.age_distribution(),
+        }
+
+
+def print_fleet_summary(snapshot: FleetSnapshot, as_json: bool = False) -> None:
+    summary = snapshot.summary()
+    if as_json:
+        print(json.dumps(summary, ensure_ascii=False))
+        return
+    print(
+        f"Fleet snapshot: {summary['listed']}/{summary['targets']} {summary['source']}, "
+        f"{summary['jobs']} jobs ({summary['failed']} {summary['source']} failed)"
+    )
+    print("Jobs by state:")
+    for state, count in sorted(summary["states"].items(), key=lambda item: -item[1]):
+        print(f"  {state}: {count}")
+    print("Queue depth (active jobs):")
+    for target_id, entry in summary["queue_depth"].items():
+        if entry["depth"]:
+            print(f"  {entry['name']} ({target_id}): {entry['depth']}")
+    print("Active job age:")
+    for label, count in summary["age_distribution"].items():
+        print(f"  {label}: {count}")
+
+
+class TokenBucket:
+    """Thread-safe budget of `rate` units per second with bursts up to `burst`.
+
+    Used for request rates (units = calls) and upload bandwidth (units =
+    bytes). A request larger than `burst` waits for a full bucket and then
+    leaves it in debt, so large chunks are still charged in full.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out budget for `seconds` (e.g. after a 429 Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _take(self, amount: float) -> float:
+        """Take `amount` if available and return 0, else return the seconds to wait. Lock held."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._updated = now
+            return self._paused_until - now
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        needed = min(amount, self.burst)
+        if self._tokens >= needed:
+            self._tokens -= amount
+            return 0.0
+        return (needed - self._tokens) / self.rate
+
+    def acquire(self, amount: float = 1.0, deadline: Optional[float] = None) -> None:
+        """Wait for `amount`; TimeoutError if that would pass `deadline` (`time.monotonic()`)."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                wait_for = self._take(amount)
+            if wait_for <= 0:
+                return
+            if deadline is not None and time.monotonic() + wait_for > deadline:
+                raise TimeoutError("Deadline exceeded waiting for throttle budget")
+            time.sleep(wait_for)
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Take `amount` only if it is available right now."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            return self._take(amount) <= 0
+
+
+PRIORITY_CLASSES = ("high", "normal", "bulk")
+
+
+class ScheduledJob:
+    """A queued unit of work plus the attributes the scheduler ranks it by."""
+
+    __slots__ = ("payload", "priority", "submitter", "printer_id", "group", "enqueued_at")
+
+    def __init__(self, payload: Any, priority: str, submitter: str, printer_id: str, group: Optional[str]) -> None:
+        self.payload = payload
+        self.priority = priority
+        self.submitter = submitter
+        self.printer_id = printer_id
+        self.group = group
+        self.enqueued_at = time.monotonic()
+
+
+class JobScheduler:
+    """Priority and fairness scheduler in front of the submission pipeline.
+
+    Higher priority classes are always served first. Within a class,
+    submitters take turns round-robin. A job whose printer already has
+    `max_per_printer` jobs in flight, or whose group (e.g. tenant) is at its
+    `group_limit`, is skipped for a later job, so a saturated printer does not
+    hold up the rest of the queue. Queue time (enqueue to dispatch) is kept
+    per priority class.
+
+    Waiting jobs are indexed priority -> submitter -> (printer, group), FIFO
+    within each queue. All jobs in a queue share the same limits, so a blocked
+    queue is skipped by checking its head and dispatch cost does not grow
+    with queue length.
+    """
+
+    def __init__(self, max_per_printer: int = 2, group_limit: Optional[Callable[[str], int]] = None) -> None:
+        self.max_per_printer = max(1, max_per_printer)
+        self.group_limit = group_limit
+        self._queues: Dict[str, "OrderedDict[str, OrderedDict[Tuple[str, Optional[str]], Deque[ScheduledJob]]]"] = {cls: OrderedDict() for cls in PRIORITY_CLASSES}
+        self._printer_in_flight: Dict[str, int] = {}
+        self._group_in_flight: Dict[str, int] = {}
+        self._queued = 0
+        self._wait_samples: Dict[str, Deque[float]] = {cls: deque(maxlen=10000) for cls in PRIORITY_CLASSES}
+        self._wait_totals: Dict[str, List[float]] = {cls: [0, 0.0, 0.0] for cls in PRIORITY_CLASSES}
+        self._lock = threading.Lock()
+
+    def submit(self, payload: Any, priority: str = "normal", submitter: str = "default", printer_id: str = "", group: Optional[str] = None) -> ScheduledJob:
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority} (expected one of {', '.join(PRIORITY_CLASSES)})")
+        job = ScheduledJob(payload, priority, submitter, printer_id, group)
+        with self._lock:
+            queues = self._queues[priority].setdefault(submitter, OrderedDict())
+            queues.setdefault((printer_id, group), deque()).append(job)
+            self._queued += 1
+        return job
+
+    def queued(self) -> int:
+        with self._lock:
+            return self._queued
+
+    def _eligible(self, job: ScheduledJob) -> bool:
+        if self._printer_in_flight.get(job.printer_id, 0) >= self.max_per_printer:
+            return False
+        if job.group is not None and self.group_limit is not None:
+            return self._group_in_flight.get(job.group, 0) < self.group_limit(job.group)
+        return True
+
+    def next_ready(self) -> Optional[ScheduledJob]:
+        """Pop the next job allowed to run now, or None."""
+        with self._lock:
+            for priority in PRIORITY_CLASSES:
+                submitters = self._queues[priority]
+                for submitter in list(submitters):
+                    queues = submitters[submitter]
+                    for slot in list(queues):
+                        queue = queues[slot]
+                        if not self._eligible(queue[0]):
+                            continue
+                        job = queue.popleft()
+                        if queue:
+                            queues.move_to_end(slot)
+                        else:
+                            del queues[slot]
+                        if queues:
+                            submitters.move_to_end(submitter)
+                        else:
+                            del submitters[submitter]
+                        self._dispatched(job)
+                        return job
+        return None
+
+    def _dispatched(self, job: ScheduledJob) -> None:
+        self._queued -= 1
+        self._printer_in_flight[job.printer_id] = self._printer_in_flight.get(job.printer_id, 0) + 1
+        if job.group is not None:
+            self._group_in_flight[job.group] = self._group_in_flight.get(job.group, 0) + 1
+        waited = time.monotonic() - job.enqueued_at
+        self._wait_samples[job.priority].append(waited)
+        totals = self._wait_totals[job.priority]
+        totals[0] += 1
+        totals[1] += waited
+        totals[2] = max(totals[2], waited)
+
+    def drain(self) -> List[ScheduledJob]:
+        """Remove and return every queued job without dispatching it."""
+        with self._lock:
+            jobs = [
+                job
+                for submitters in self._queues.values()
+                for queues in submitters.values()
+                for queue in queues.values()
+                for job in queue
+            ]
+            for submitters in self._queues.values():
+                submitters.clear()
+            self._queued = 0
+            return jobs
+
+    def done(self, job: ScheduledJob) -> None:
+        with self._lock:
+            self._printer_in_flight[job.printer_id] -= 1
+            if job.group is not None:
+                self._group_in_flight[job.group] -= 1
+
+    def queue_time_stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-class dispatched count and mean/p50/p95/max queue time in seconds."""
+        stats: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for priority in PRIORITY_CLASSES:
+                count, total, longest = self._wait_totals[priority]
+                if not count:
+                    continue
+                samples = sorted(self._wait_samples[priority])
+                stats[priority] = {
+                    "count": count,
+                    "mean": total / count,
+                    "p50": samples[len(samples) // 2],
+                    "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+                    "max": longest,
+                }
+        return stats
+
+    def run(
+        self,
+        handler: Callable[[Any], Any],
+        workers: int,
+        on_done: Callable[[ScheduledJob, Any], None],
+        feed: Optional[Callable[[], bool]] = None,
+        feed_interval: float = 1.0,
+    ) -> None:
+        """Dispatch queued jobs to `workers` threads until the queue drains.
+
+        `on_done(job, future)` runs on the calling thread for each finished job.
+        When `feed` is given it is called every `feed_interval` seconds to
+        enqueue more work, and the loop keeps going until it returns False.
+        Jobs still queued when nothing is in flight can never be dispatched
+        (their group limit is 0); they are passed to `on_done` with a failed
+        future instead of being left in the queue.
+        """
+        workers = max(1, workers)
+        pending: Dict[Any, ScheduledJob] = {}
+        next_feed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    if feed is not None and time.monotonic() >= next_feed:
+                        if not feed():
+                            feed = None
+                        next_feed = time.monotonic() + feed_interval
+                    while len(pending) < workers:
+                        job = self.next_ready()
+                        if job is None:
+                            break
+                        pending[pool.submit(handler, job.payload)] = job
+                    if not pending:
+                        for job in self.drain():
+                            unschedulable: "Future[Any]" = Future()
+                            unschedulable.set_exception(RuntimeError(f"Job cannot be scheduled: group {job.group!r} allows no concurrent jobs"))
+                            on_done(job, unschedulable)
+                        if feed is None:
+                            return
+                        time.sleep(max(0.0, next_feed - time.monotonic()))
+                        continue
+                    timeout = max(0.0, next_feed - time.monotonic()) if feed is not None else None
+                    done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = pending.pop(future)
+                        self.done(job)
+                        on_done(job, future)
+            finally:
+                # Settle in-flight jobs even when interrupted so counters and callbacks stay consistent
+                for future in list(pending):
+                    job = pending.pop(future)
+                    wait([future])
+                    self.done(job)
+                    on_done(job, future)
+
+
+def print_queue_time_stats(scheduler: JobScheduler) -> None:
+    stats = scheduler.queue_time_stats()
+    if not stats:
+        return
+    print("Queue time by priority:")
+    for priority, entry in stats.items():
+        print(
+            f"  {priority}: n={int(entry['count'])} mean={entry['mean']:.2f}s "
+            f"p50={entry['p50']:.2f}s p95={entry['p95']:.2f}s max={entry['max']:.2f}s"
+        )
+
+
+class TenantContext:
+    """Isolated state for one customer tenant.
+
+    Owns its token, HTTP connection pool, metadata caches and throttle budget,
+    so one tenant's load or failures do not leak into another's. Token and
+    session are created on first use.
+    """
+
+    def __init__(self, key: str, config: Dict[str, Any], default_cache_path: Optional[str] = None, scopes: Optional[List[str]] = None) -> None:
+        self.key = key
+        self.tenant_id: str = config["tenant_id"]
+        self.client_id: str = config["client_id"]
+        self.client_secret: Optional[str] = config.get("client_secret") or (
+            os.getenv(config["client_secret_env"]) if config.get("client_secret_env") else None
+        )
+        self.auth: str = config.get("auth", "app")
+        self.scopes: List[str] = config.get("scopes") or scopes or []
+        self.cache_path: Optional[str] = config.get("cache_path", f"{default_cache_path}.{key}" if default_cache_path else None)
+        self.pool_size = int(config.get("pool_size", 8))
+        self.throttle = TokenBucket(float(config.get("requests_per_second", 10)), float(config.get("burst", 20)))
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+        self.in_flight = 0
+        self._token = CachedToken(self._fetch_token)
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+        if self.auth == "app" and not self.client_secret:
+            raise RuntimeError(f"Tenant {key}: client_secret or client_secret_env is required for app auth")
+
+    def _fetch_token(self) -> str:
+        if _TRANSPORT["replay"] is not None:
+            return "replay"
+        if self.auth == "app":
+            return get_access_token(self.tenant_id, self.client_id, self.client_secret or "", cache_path=self.cache_path)
+        return get_user_token_device_code(self.tenant_id, self.client_id, self.scopes, cache_path=self.cache_path)
+
+    def token(self) -> str:
+        """Return a valid access token, refreshing five minutes before expiry."""
+        return self._token.get()
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            self._token.clear()
+            self.metadata.clear()
+
+
+class TenantRegistry:
+    """Lazily create tenant contexts and evict idle ones beyond `max_active`.
+
+    Busy tenants (jobs in flight) are never evicted, so the limit may be
+    exceeded briefly when every active tenant is working.
+    """
+
+    def __init__(self, configs: Dict[str, Dict[str, Any]], max_active: int = 16, default_cache_path: Optional[str] = None, scopes: Optional[List[str]] = None) -> None:
+        self.configs = configs
+        self.max_active = max(1, max_active)
+        self.default_cache_path = default_cache_path
+        self.scopes = scopes
+        self._active: "OrderedDict[str, TenantContext]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> TenantContext:
+        """Get (or create) a tenant context and mark a job in flight on it."""
+        with self._lock:
+            tenant = self._active.get(key)
+            if tenant is None:
+                if key not in self.configs:
+                    raise RuntimeError(f"Unknown tenant: {key}")
+                tenant = TenantContext(key, self.configs[key], self.default_cache_path, self.scopes)
+                self._active[key] = tenant
+            self._active.move_to_end(key)
+            tenant.in_flight += 1
+            self._evict_idle()
+            return tenant
+
+    def release(self, tenant: TenantContext) -> None:
+        with self._lock:
+            tenant.in_flight -= 1
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        for key in list(self._active):
+            if len(self._active) <= self.max_active:
+                return
+            tenant = self._active[key]
+            if tenant.in_flight == 0:
+                del self._active[key]
+                tenant.close()
+
+    def max_concurrent_jobs(self, key: str) -> int:
+        """Concurrent job limit for a tenant (config `max_concurrent_jobs`, default 4)."""
+        return int(self.configs.get(key, {}).get("max_concurrent_jobs", 4))
+
+    def close(self) -> None:
+        with self._lock:
+            for tenant in self._active.values():
+                tenant.close()
+            self._active.clear()
+
+
+def load_tenants_config(path: str) -> Dict[str, Dict[str, Any]]:
+    """Read `{"tenants": {key: {tenant_id, client_id, ...}}}` from a JSON file."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    tenants = data.get("tenants") if isinstance(data, dict) else None
+    if not isinstance(tenants, dict) or not tenants:
+        raise RuntimeError(f"No tenants defined in {path}")
+    for key, config in tenants.items():
+        missing = [field for field in ("tenant_id", "client_id") if not config.get(field)]
+        if missing:
+            raise RuntimeError(f"Tenant {key} in {path} is missing: {', '.join(missing)}")
+    return tenants
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """Read one job per line: {"tenant", "printer_id", "file", optional "job_name"/"content_type"}."""
+    jobs: List[Dict[str, Any]] = []
+    with open(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            missing = [field for field in ("printer_id", "file") if not job.get(field)]
+            if missing:
+                raise RuntimeError(f"{path}:{line_no}: missing {', '.join(missing)}")
+            jobs.append(job)
+    return jobs
+
+
+_PRINTER_SETUP_LOCK = threading.Lock()
+
+
+def _job_configuration_overrides(args: argparse.Namespace) -> Dict[str, Any]:
+    """Job settings given on the command line (--copies, --duplex-mode, --media-size)."""
+    values = (("copies", args.copies), ("duplexMode", args.duplex_mode), ("mediaSize", args.media_size))
+    return {key: value for key, value in values if value is not None}
+
+
+def _printer_setup(
+    token: str,
+    printer_id: str,
+    debug: bool = False,
+    deadline: Optional[float] = None,
+    overrides: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Per-printer job settings (configuration, share, capabilities), cached per tenant.
+
+    `overrides` are applied on top of the printer defaults before validation;
+    they are the same for every job in a run, so the cached result holds them.
+    Concurrent first jobs for a printer wait on a per-printer lock, so the
+    lookups run once.
+    """
+    with _PRINTER_SETUP_LOCK:
+        lock = _metadata_cache("printer_setup_locks").setdefault(printer_id, threading.Lock())
+    with lock:
+        return _printer_setup_locked(token, printer_id, debug, deadline, overrides or {})
+
+
+def _printer_setup_locked(token: str, printer_id: str, debug: bool, deadline: Optional[float], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    cache = _metadata_cache("printer_setup")
+    setup = cache.get(printer_id)
+    if setup is not None:
+        return setup
+    preflight_printer(token, printer_id, debug=debug, deadline=deadline)
+    job_configuration = _build_job_configuration_from_defaults(_get_printer_defaults(token, printer_id, debug=debug, deadline=deadline))
+    job_configuration.update(overrides)
+    shares = _discover_printer_shares(token, printer_id, debug=debug, deadline=deadline)
+    capabilities = _get_printer_capabilities(token, printer_id, debug=debug, deadline=deadline)
+    validate_job_configuration(job_configuration, capabilities)
+    setup = {
+        "job_configuration": job_configuration,
+        "share_id": shares[0].get("id") if shares else None,
+        "capabilities": capabilities,
+    }
+    cache[printer_id] = setup
+    return setup
+
+
+def run_tenant_job(registry: TenantRegistry, job: Dict[str, Any], args: argparse.Namespace, bandwidth: Optional[TokenBucket] = None) -> str:
+    """Submit one manifest job with its tenant's token, pool, caches and throttle.
+
+    Returns once the job is started; polling is left to the caller so the
+    printer and tenant slots are freed for the next job.
+    """
+    tenant = registry.acquire(job["tenant"])
+    context_token = _ACTIVE_TENANT.set(tenant)
+    try:
+        deadline = time.monotonic() + args.deadline if args.deadline else None
+        token = tenant.token()
+        setup = _printer_setup(token, job["printer_id"], debug=args.debug, deadline=deadline, overrides=_job_configuration_overrides(args))
+        job_id = submit_document(
+            token,
+            job["printer_id"],
+            job["file"],
+            job.get("job_name") or f"{args.job_name} - {os.path.basename(job['file'])}",
+            job.get("content_type") or args.content_type,
+            job_configuration=setup["job_configuration"],
+            share_id=setup["share_id"],
+            debug=args.debug,
+            capabilities=setup["capabilities"],
+            max_bytes=args.max_document_bytes,
+            deadline=deadline,
+            bandwidth=bandwidth,
+        )
+        return job_id
+    finally:
+        _ACTIVE_TENANT.reset(context_token)
+        registry.release(tenant)
+
+
+def run_multi_tenant(args: argparse.Namespace) -> int:
+    """Entry point for --tenants-config: route manifest jobs to their tenants.
+
+    Jobs go through the JobScheduler: by priority class, round-robin across
+    submitters (the tenant unless the line names one), and no tenant runs
+    more than its `max_concurrent_jobs`. A tenant with a long queue therefore
+    cannot take every worker.
+    """
+    if not args.manifest:
+        print("Missing required arguments: --manifest", file=sys.stderr)
+        return 2
+    try:
+        configs = load_tenants_config(args.tenants_config)
+        jobs = load_manifest(args.manifest)
+        for job in jobs:
+            job.setdefault("tenant", args.tenant)
+            if job["tenant"] not in configs:
+                raise RuntimeError(f"Unknown tenant {job['tenant']!r} for {job['file']}")
+            if not os.path.exists(job["file"]):
+                raise RuntimeError(f"File not found: {job['file']}")
+            if job.get("priority") and job["priority"] not in PRIORITY_CLASSES:
+                raise RuntimeError(f"Unknown priority {job['priority']!r} for {job['file']}")
+    except Exception as exc:  # noqa: BLE001
+        print(f"Error: {exc}", file=sys.stderr)
+        return 2
+
+    registry = TenantRegistry(configs, max_active=args.max_active_tenants, default_cache_path=args.cache_path or None, scopes=args.scopes)
+    scheduler = JobScheduler(max_per_printer=args.max_per_printer, group_limit=registry.max_concurrent_jobs)
+    bandwidth = _upload_bandwidth(args)
+    for job in jobs:
+        scheduler.submit(
+            job,
+            priority=job.get("priority") or args.priority,
+            submitter=job.get("submitter") or job["tenant"],
+            printer_id=job["printer_id"],
+            group=job["tenant"],
+        )
+    results: Dict[str, Dict[str, int]] = {job["tenant"]: {"submitted": 0, "failed": 0} for job in jobs}
+    started_jobs: List[Tuple[Dict[str, Any], str]] = []
+
+    def on_done(scheduled: ScheduledJob, future: Any) -> None:
+        job = scheduled.payload
+        try:
+            job_id = future.result()
+            results[job["tenant"]]["submitted"] += 1
+            started_jobs.append((job, job_id))
+            print(f"[{job['tenant']}] {job['file']}: job {job_id}")
+        except Exception as exc:  # noqa: BLE001
+            results[job["tenant"]]["failed"] += 1
+            print(f"Error: [{job['tenant']}] {job['file']}: {exc}", file=sys.stderr)
+
+    poll_failures = 0
+    try:
+        scheduler.run(lambda job: run_tenant_job(registry, job, args, bandwidth), args.workers, on_done)
+        if args.poll:
+            for job, job_id in started_jobs:
+                tenant = registry.acquire(job["tenant"])
+                context_token = _ACTIVE_TENANT.set(tenant)
+                try:
+                    poll_until_completed(tenant.token(), job["printer_id"], job_id)
+                except Exception as exc:  # noqa: BLE001
+                    poll_failures += 1
+                    print(f"Error: [{job['tenant']}] job {job_id}: {exc}", file=sys.stderr)
+                finally:
+                    _ACTIVE_TENANT.reset(context_token)
+                    registry.release(tenant)
+    finally:
+        registry.close()
+
+    failures = poll_failures
+    for key, counts in results.items():
+        failures += counts["failed"]
+        print(f"{key}: {counts['submitted']} submitted, {counts['failed']} failed")
+    print_queue_time_stats(scheduler)
+    return 1 if failures else 0
+
+
+def _upload_bandwidth(args: argparse.Namespace) -> Optional[TokenBucket]:
+    """Process-wide upload budget in bytes per second, or None when unlimited."""
+    if not args.max_upload_bandwidth:
+        return None
+    return TokenBucket(args.max_upload_bandwidth, args.max_upload_bandwidth)
+
+
+def _required_credentials(args: argparse.Namespace) -> List[Tuple[str, Any]]:
+    if args.replay:
+        return []
+    required: List[Tuple[str, Any]] = [("--tenant-id", args.tenant_id), ("--client-id", args.client_id)]
     if args.auth == "app":
-        required_base.append(("--client-secret", args.client_secret))
+        required.append(("--client-secret", args.client_secret))
+    return required
+
+
+def _acquire_token(args: argparse.Namespace) -> str:
+    if args.replay:
+        # Replayed responses never reach Graph; the token only fills headers
+        return "replay"
+    if args.auth == "app":
+        return get_access_token(args.tenant_id, args.client_id, args.client_secret, cache_path=args.cache_path)
+    return get_user_token_device_code(args.tenant_id, args.client_id, args.scopes, cache_path=args.cache_path)
+
+
+def run_fleet_status(args: argparse.Namespace) -> int:
+    """Entry point for --fleet-status: snapshot jobs across the whole fleet."""
+    missing = [name for name, val in _required_credentials(args) if not val]
+    if missing:
+        print(f"Missing required arguments: {' '.join(missing)}", file=sys.stderr)
+        return 2
+
+    try:
+        token = _acquire_token(args)
+        if args.debug:
+            debug_print_token_claims(token)
+        snapshot = FleetSnapshot(token, source=args.fleet_source, max_workers=args.fleet_concurrency, debug=args.debug)
+        snapshot.discover_targets()
+        started = time.time()
+        snapshot.refresh()
+        if args.debug:
+            print(f"[debug] listed {len(snapshot.records)} {args.fleet_source} in {time.time() - started:.1f}s", file=sys.stderr)
+        print_fleet_summary(snapshot, as_json=args.json)
+        if args.fleet_refresh <= 0:
+            return 1 if snapshot.errors else 0
+
+        discovered_at = time.monotonic()
+        try:
+            while True:
+                time.sleep(args.fleet_refresh)
+                # Tokens expire; refresh before each round (cached by MSAL where possible)
+                snapshot.token = _acquire_token(args)
+                if time.monotonic() - discovered_at >= args.fleet_discover_interval:
+                    # Pick up added and removed printers; keep the old list if discovery fails
+                    try:
+                        count = snapshot.discover_targets()
+                        discovered_at = time.monotonic()
+                        if args.debug:
+                            print(f"[debug] rediscovered {count} {args.fleet_source}", file=sys.stderr)
+                    except Exception as exc:  # noqa: BLE001
+                        print(f"Warning: could not rediscover {args.fleet_source}: {exc}", file=sys.stderr)
+                refreshed = snapshot.refresh(max_age=args.fleet_max_age)
+                if args.debug:
+                    print(f"[debug] refreshed {refreshed} stale {args.fleet_source}", file=sys.stderr)
+                print_fleet_summary(snapshot, as_json=args.json)
+        except KeyboardInterrupt:
+            return 0
+    except Exception as exc:  # noqa: BLE001
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+
+def run_print(args: argparse.Namespace) -> int:
+    """Entry point for printing: single file, batch or watch-directory daemon."""
+    files: List[str] = [args.file] if isinstance(args.file, str) else list(args.file or [])
+
+    required_base = _required_credentials(args) + [("--printer-id", args.printer_id)]
+    if not args.watch_dir:
+        required_base.append(("--file", files))
     missing = [name for name, val in required_base if not val]
     if missing:
         print(f"Missing required arguments: {' '.join(missing)}", file=sys.stderr)
         return 2
     
     # Validate file exists
-    if not os.path.exists(args.file):
-        print(f"Error: File not found: {args.file}", file=sys.stderr)
+    for file_path in files:
+        if not os.path.exists(file_path):
+            print(f"Error: File not found: {file_path}", file=sys.stderr)
+            return 2
+    if args.watch_dir and not os.path.isdir(args.watch_dir):
+        print(f"Error: Watch directory not found: {args.watch_dir}", file=sys.stderr)
         return 2
 
     try:
-        if args.auth == "app":
-            token = get_access_token(args.tenant_id, args.client_id, args.client_secret)
-        else:
-            token = get_user_token_device_code(args.tenant_id, args.client_id, args.scopes, cache_path=args.cache_path)
+        # Fetched again per job near expiry so a long-running watch keeps working
+        tokens = CachedToken(lambda: _acquire_token(args))
+        token = tokens.get()
         if args.debug:
             debug_print_token_claims(token)
 
+        def job_deadline() -> Optional[float]:
+            return time.monotonic() + args.deadline if args.deadline else None
+
+        # Printer setup lookups share one deadline budget
+        setup_deadline = job_deadline()
+
         # Preflight permission and existence check for the printer
-        preflight = requests.get(
-            f"{GRAPH_BASE_URL}/print/printers/{args.printer_id}?$select=id,displayName,manufacturer,model",
-            headers=graph_headers(token),
-            timeout=30,
-        )
-        if preflight.status_code == 404:
-            raise RuntimeError(_build_graph_error_message("Validate printer (not found)", preflight))
-        if preflight.status_code == 403:
-            raise RuntimeError(_build_graph_error_message("Validate printer (forbidden)", preflight))
-        if preflight.status_code != 200:
-            raise RuntimeError(_build_graph_error_message("Validate printer", preflight))
-        if args.debug:
-            meta = preflight.json()
-            print(f"[debug] printer ok: {meta.get('id')} {meta.get('displayName')}", file=sys.stderr)
+        preflight_printer(token, args.printer_id, debug=args.debug, deadline=setup_deadline)
 
         # Build job configuration from printer defaults to avoid 400 Missing configuration
-        defaults = _get_printer_defaults(token, args.printer_id, debug=args.debug)
+        defaults = _get_printer_defaults(token, args.printer_id, debug=args.debug, deadline=setup_deadline)
         job_configuration = _build_job_configuration_from_defaults(defaults)
+        job_configuration.update(_job_configuration_overrides(args))
         if args.debug and job_configuration:
             try:
                 print(f"[debug] job configuration: {json.dumps(job_configuration, separators=(',', ':'), ensure_ascii=False)}", file=sys.stderr)
@@ -788,7 +2542,7 @@ def main() -> int:
 
         # Discover printer shares before creating the job
         # This allows us to create the job via the share endpoint which is often more reliable
-        matching_shares = _discover_printer_shares(token, args.printer_id, debug=args.debug)
+        matching_shares = _discover_printer_shares(token, args.printer_id, debug=args.debug, deadline=setup_deadline)
         preferred_share_id = None
         if matching_shares:
             preferred_share_id = matching_shares[0].get("id")
@@ -797,49 +2551,261 @@ def main() -> int:
         elif args.debug:
             print(f"[debug] no shares found, will use printer endpoint for job creation", file=sys.stderr)
 
-        job, job_share_id = create_print_job(
-            token, 
-            args.printer_id, 
-            args.job_name, 
-            job_configuration=job_configuration or None, 
-            debug=args.debug,
-            share_id=preferred_share_id
-        )
-        job_id = job.get("id")
-        if not job_id:
-            raise RuntimeError("Job ID missing in create job response")
-        print(f"Created job {job_id}")
+        # Validate the configuration up front; documents are checked one by one before upload
+        capabilities = _get_printer_capabilities(token, args.printer_id, debug=args.debug, deadline=setup_deadline)
+        validate_job_configuration(job_configuration, capabilities)
 
-        # Upload document to the job
-        print("Uploading document...")
-        document_id, upload_url = create_document_and_upload_session(
-            token,
-            args.printer_id,
-            job_id,
-            args.file,
-            args.content_type,
-            debug=args.debug,
-            share_id=job_share_id
-        )
-        
-        upload_file_to_upload_session(upload_url, args.file)
-        print("Upload complete.")
+        # Coalescing only applies when the printer accepts the merged PDF
+        coalescer: Optional[DocumentCoalescer] = None
+        if args.coalesce:
+            if _printer_accepts_content_type(capabilities, "application/pdf"):
+                _load_pypdf()
+                coalescer = DocumentCoalescer(args.coalesce_max_bytes, args.coalesce_max_docs, args.coalesce_window)
+            else:
+                print("Warning: printer does not accept application/pdf; coalescing disabled", file=sys.stderr)
+
+        batch_mode = len(files) > 1 or bool(args.watch_dir)
+        scheduler = JobScheduler(max_per_printer=args.max_per_printer)
+        bandwidth = _upload_bandwidth(args)
+        submitted: List[Dict[str, Any]] = []
+        failures = 0
+        # Watched files queued or in flight; they are moved to done/ or failed/ once handled
+        watched: set = set()
+
+        def settle(sources: List[str], outcome: str) -> None:
+            for source in sources:
+                key = os.path.abspath(source)
+                if key not in watched:
+                    continue
+                watched.discard(key)
+                try:
+                    _archive_watch_file(args.watch_dir, source, outcome)
+                except OSError as exc:
+                    print(f"Warning: could not move {source} to {outcome}/: {exc}", file=sys.stderr)
+
+        def handle(work: Tuple[str, Any]) -> List[Dict[str, Any]]:
+            kind, item = work
+            if kind == "group":
+                return submit_coalesced_group(
+                    tokens.get(),
+                    item,
+                    args.job_name,
+                    job_configuration,
+                    share_id=preferred_share_id,
+                    debug=args.debug,
+                    capabilities=capabilities,
+                    max_bytes=args.max_document_bytes,
+                    deadline=job_deadline(),
+                    bandwidth=bandwidth,
+                )
+            name = f"{args.job_name} - {os.path.basename(item)}" if batch_mode else args.job_name
+            job_id = submit_document(
+                tokens.get(),
+                args.printer_id,
+                item,
+                name,
+                args.content_type,
+                job_configuration=job_configuration,
+                share_id=preferred_share_id,
+                debug=args.debug,
+                capabilities=capabilities,
+                max_bytes=args.max_document_bytes,
+                deadline=job_deadline(),
+                bandwidth=bandwidth,
+            )
+            return [{"source": item, "job_id": job_id, "first_page": None, "last_page": None}]
 
-        # Start the job
-        print("Starting job...")
-        start_print_job(token, args.printer_id, job_id, share_id=job_share_id, debug=args.debug)
-        print("Job started.")
+        def on_done(scheduled: ScheduledJob, future: Any) -> None:
+            nonlocal failures
+            kind, item = scheduled.payload
+            sources = item.sources if kind == "group" else [item]
+            try:
+                records = future.result()
+            except Exception as exc:  # noqa: BLE001
+                settle(sources, "failed")
+                failures += len(sources)
+                if batch_mode:
+                    print(f"Error: {', '.join(sources)}: {exc}", file=sys.stderr)
+                else:
+                    print(f"Error: {exc}", file=sys.stderr)
+                return
+            for record in records:
+                if record.get("error"):
+                    failures += 1
+                    settle([record["source"]], "failed")
+                    print(f"Error: {record['source']}: {record['error']}", file=sys.stderr)
+                else:
+                    submitted.append(record)
+                    settle([record["source"]], "done")
+
+        def enqueue_groups(groups: List[CoalesceGroup]) -> None:
+            for group in groups:
+                priority, submitter = group.key
+                scheduler.submit(("group", group), priority=priority, submitter=submitter, printer_id=group.printer_id)
+
+        def enqueue(file_path: str, priority: str, submitter: str) -> None:
+            nonlocal failures
+            try:
+                size = os.path.getsize(file_path)
+                effective_content_type, _ = detect_content_type(file_path, args.content_type, debug=args.debug)
+            except Exception as exc:  # noqa: BLE001
+                failures += 1
+                print(f"Error: {file_path}: {exc}", file=sys.stderr)
+                settle([file_path], "failed")
+                return
+            # High-priority documents skip coalescing so they never wait for a window
+            if coalescer and priority != "high" and effective_content_type == "application/pdf" and size <= args.coalesce_max_bytes:
+                # Same checks as an individual upload, so merging cannot bypass them
+                try:
+                    prepare_document_for_printer(file_path, args.content_type, capabilities, max_bytes=args.max_document_bytes)
+                except Exception as exc:  # noqa: BLE001
+                    failures += 1
+                    print(f"Error: {file_path}: {exc}", file=sys.stderr)
+                    settle([file_path], "failed")
+                    return
+                try:
+                    pdf_page_count(file_path)
+                except RuntimeError as exc:
+                    # Unreadable by pypdf; the printer may still take it as a separate job
+                    if args.debug:
+                        print(f"[debug] not coalescing {file_path}: {exc}", file=sys.stderr)
+                else:
+                    enqueue_groups(coalescer.add(args.printer_id, file_path, size, key=(priority, submitter)))
+                    return
+            scheduler.submit(("document", file_path), priority=priority, submitter=submitter, printer_id=args.printer_id)
+
+        for file_path in files:
+            enqueue(file_path, args.priority, args.submitter)
+
+        if args.watch_dir:
+            # (size, mtime) per file from the previous scan; a file is only picked
+            # up once it is unchanged for a whole interval, i.e. fully written
+            last_scan: Dict[str, Tuple[int, int]] = {}
+
+            def feed() -> bool:
+                nonlocal last_scan
+                scan: Dict[str, Tuple[int, int]] = {}
+                for file_path in _list_watch_dir(args.watch_dir):
+                    key = os.path.abspath(file_path)
+                    if key in watched:
+                        continue
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    scan[key] = (stat.st_size, stat.st_mtime_ns)
+                    if last_scan.get(key) != scan[key]:
+                        continue
+                    watched.add(key)
+                    priority, submitter = _classify_watch_path(args.watch_dir, file_path, args.priority, args.submitter)
+                    enqueue(file_path, priority, submitter)
+                last_scan = scan
+                if coalescer:
+                    enqueue_groups(coalescer.due())
+                return True
+
+            print(f"Watching {args.watch_dir} for new documents (Ctrl+C to stop)...")
+            try:
+                scheduler.run(handle, args.workers, on_done, feed=feed, feed_interval=args.watch_interval)
+            except KeyboardInterrupt:
+                print("Stopping watch...")
+
+        if coalescer:
+            enqueue_groups(coalescer.flush())
+        scheduler.run(handle, args.workers, on_done)
+
+        if batch_mode:
+            job_count = len({entry["job_id"] for entry in submitted})
+            print(f"Submitted {len(submitted)} documents in {job_count} jobs ({failures} failed)")
+            print_queue_time_stats(scheduler)
 
         if args.poll:
-            poll_until_completed(token, args.printer_id, job_id)
+            for job_id in dict.fromkeys(entry["job_id"] for entry in submitted):
+                poll_until_completed(tokens.get(), args.printer_id, job_id)
             print("Job finished.")
 
-        return 0
+        if args.debug and args.hedge:
+            print(f"[debug] hedged requests: sent={HEDGE_STATS['sent']} won={HEDGE_STATS['won']}", file=sys.stderr)
+        return 1 if failures else 0
     except Exception as exc:  # noqa: BLE001
         print(f"Error: {exc}", file=sys.stderr)
         return 1
 
 
+def main() -> int:
+    load_env()
+
+    parser = argparse.ArgumentParser(description="Create and start a Universal Print job via Microsoft Graph")
+    parser.add_argument("--printer-id", default=os.getenv("PRINTER_ID"), help="Printer ID in Universal Print")
+    parser.add_argument("--file", nargs="+", default=os.getenv("FILE_PATH"), help="Path(s) to the file(s) to print; several paths run in batch mode")
+    parser.add_argument("--job-name", default="UP Job", help="Display name for the print job")
+    parser.add_argument("--content-type", default=os.getenv("CONTENT_TYPE"), help="MIME type of the document (e.g., application/pdf)")
+    parser.add_argument("--poll", action="store_true", help="Poll job status until completion")
+    parser.add_argument("--debug", action="store_true", help="Print token claims and verbose diagnostics")
+    parser.add_argument("--auth", choices=["app", "device"], default=os.getenv("AUTH", "app"), help="Authentication mode: app (client credentials) or device (device code delegated)")
+    parser.add_argument("--scopes", nargs="*", default=os.getenv("SCOPES", "Printer.Read.All PrintJob.ReadWrite.All PrintJob.Manage.All offline_access").split(), help="Delegated scopes for device auth (space-separated)")
+    parser.add_argument("--cache-path", default=os.getenv("MSAL_CACHE_PATH", os.path.expanduser("~/.msal_up_cli_cache.json")), help="Path to the MSAL token cache shared by all processes on this host (both auth modes; empty to disable)")
+    parser.add_argument("--tenant-id", default=os.getenv("TENANT_ID"), help="Azure AD tenant ID")
+    parser.add_argument("--client-id", default=os.getenv("CLIENT_ID"), help="App registration client ID")
+    parser.add_argument("--client-secret", default=os.getenv("CLIENT_SECRET"), help="App registration client secret")
+    parser.add_argument("--watch-dir", default=os.getenv("WATCH_DIR"), help="Daemon mode: keep submitting new files that appear in this directory")
+    parser.add_argument("--watch-interval", type=float, default=5.0, help="Seconds between directory scans in daemon mode")
+    parser.add_argument("--coalesce", action="store_true", help="Merge small PDFs for the same printer into fewer jobs (batch and daemon modes; requires pypdf)")
+    parser.add_argument("--coalesce-max-bytes", type=int, default=10 * 1024 * 1024, help="Maximum combined size of a coalesced job; larger PDFs are submitted alone")
+    parser.add_argument("--coalesce-max-docs", type=int, default=50, help="Maximum number of documents merged into one job")
+    parser.add_argument("--coalesce-window", type=float, default=30.0, help="Seconds a coalesced group may wait for more documents in daemon mode")
+    parser.add_argument("--copies", type=int, help="Number of copies (overrides the printer default)")
+    parser.add_argument("--duplex-mode", help="Duplex mode, e.g. oneSided or twoSidedLongEdge (overrides the printer default)")
+    parser.add_argument("--media-size", help="Media size, e.g. 'ISO A4' or 'North America Letter' (overrides the printer default)")
+    parser.add_argument("--max-document-bytes", type=int, help="Reject documents larger than this before creating a job")
+    parser.add_argument("--fleet-status", action="store_true", help="List jobs on every printer (or share) and print queue aggregates instead of printing")
+    parser.add_argument("--fleet-source", choices=["printers", "shares"], default="printers", help="Enumerate jobs per printer or per share in fleet-status mode")
+    parser.add_argument("--fleet-concurrency", type=int, default=8, help="Maximum concurrent job listings in fleet-status mode")
+    parser.add_argument("--fleet-refresh", type=float, default=0.0, help="Keep refreshing the fleet snapshot every N seconds (0 = run once)")
+    parser.add_argument("--fleet-max-age", type=float, default=300.0, help="Only re-list printers whose snapshot is older than this many seconds when refreshing")
+    parser.add_argument("--fleet-discover-interval", type=float, default=900.0, help="Re-enumerate printers (or shares) every N seconds when refreshing")
+    parser.add_argument("--json", action="store_true", help="Emit fleet-status aggregates as JSON")
+    parser.add_argument("--deadline", type=float, help="Overall seconds allowed per job (create through start); every call's timeout is capped to what remains")
+    parser.add_argument("--hedge", action="store_true", help="Hedge idempotent reads: send a second request after an adaptive p95 delay and use the first answer")
+    parser.add_argument("--hedge-delay", type=float, default=1.0, help="Hedge delay in seconds until enough latency samples exist for a p95")
+    parser.add_argument("--record", metavar="CASSETTE", help="Record every HTTP exchange (tokens redacted) into a cassette file")
+    parser.add_argument("--replay", metavar="CASSETTE", help="Serve HTTP responses from a recorded cassette instead of the network (no sign-in)")
+    parser.add_argument("--replay-latency-scale", type=float, default=1.0, help="Multiply recorded latencies during replay (0 = no delay)")
+    parser.add_argument("--tenants-config", default=os.getenv("TENANTS_CONFIG"), help="JSON file of tenants; serve many tenants from one process (requires --manifest)")
+    parser.add_argument("--manifest", help="JSON Lines file of jobs: {\"tenant\", \"printer_id\", \"file\", optional \"job_name\"}")
+    parser.add_argument("--tenant", help="Tenant key for manifest lines that do not name one")
+    parser.add_argument("--max-active-tenants", type=int, default=16, help="Idle tenants beyond this many are evicted (least recently used first)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent job submissions (batch, daemon and multi-tenant modes)")
+    parser.add_argument("--priority", choices=list(PRIORITY_CLASSES), default="normal", help="Priority class for --file documents and top-level watched files")
+    parser.add_argument("--submitter", default="cli", help="Submitter name used for fair sharing when none is given by the manifest or watch subdirectory")
+    parser.add_argument("--max-per-printer", type=int, default=2, help="Maximum jobs uploading to one printer at a time")
+    parser.add_argument("--max-upload-bandwidth", type=float, default=0.0, help="Total upload bandwidth cap in bytes per second across all jobs (0 = unlimited)")
+    args = parser.parse_args()
+    configure_hedging(args.hedge, default_delay=args.hedge_delay)
+
+    if args.record and args.replay:
+        print("Error: --record and --replay cannot be combined", file=sys.stderr)
+        return 2
+    recorder: Optional[Cassette] = None
+    if args.record:
+        recorder = Cassette()
+        configure_transport(recorder=recorder)
+    elif args.replay:
+        configure_transport(replay=ReplayTransport(Cassette.load(args.replay), latency_scale=args.replay_latency_scale))
+
+    try:
+        if args.fleet_status:
+            return run_fleet_status(args)
+        if args.tenants_config:
+            return run_multi_tenant(args)
+        return run_print(args)
+    finally:
+        if recorder is not None:
+            recorder.save(args.record)
+            print(f"Recorded {len(recorder.exchanges)} HTTP exchanges to {args.record}", file=sys.stderr)
+        configure_transport()
+
+
 if __name__ == "__main__":
     sys.exit(main())
 